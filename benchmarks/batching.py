@@ -0,0 +1,46 @@
+"""Check that micro-batching helps: run the same load with and without it.
+
+    python -m benchmarks.batching --concurrency 1,8,32 --requests 200
+
+Runs benchmarks.run twice in fresh processes (server settings are read at
+import time), once with MICRO_BATCH_MAX_SIZE=1 and once with the batch size
+under test, then prints benchmarks.compare's table with the unbatched run as
+the baseline. Exits with status 1 if batching is slower than not batching by
+more than the threshold at any concurrency level. Any other benchmarks.run
+options (--model, --no-large, ...) are passed through.
+"""
+from typing import List, Optional
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import compare
+
+
+def run_benchmark(output: str, batch_size: int, passthrough: List[str]):
+    env = dict(os.environ, MICRO_BATCH_MAX_SIZE=str(batch_size))
+    subprocess.run([sys.executable, "-m", "benchmarks.run", "--output", output, *passthrough], env=env, check=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=8, help="MICRO_BATCH_MAX_SIZE to test (default: 8)")
+    parser.add_argument("--scenarios", default="remove_bg,batch_remove")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--threshold", type=float, default=5.0, help="Allowed slowdown in percent (default: 5)")
+    parser.add_argument("--output-dir", default=tempfile.mkdtemp(prefix="pixelforge-bench-batching-"))
+    args, passthrough = parser.parse_known_args(argv)
+    passthrough += ["--scenarios", args.scenarios, "--concurrency", args.concurrency]
+
+    unbatched = os.path.join(args.output_dir, "unbatched.json")
+    batched = os.path.join(args.output_dir, f"batched-{args.batch_size}.json")
+    run_benchmark(unbatched, 1, passthrough)
+    run_benchmark(batched, args.batch_size, passthrough)
+    print(f"Reports in {args.output_dir}", file=sys.stderr)
+    return compare.main([unbatched, batched, "--threshold", str(args.threshold)])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
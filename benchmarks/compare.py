@@ -0,0 +1,75 @@
+"""Compare two benchmark reports and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+Scenarios are matched by name and concurrency. Exits with status 1 if any
+matched scenario got slower (throughput down, latency or peak RSS up) by
+more than the threshold percentage, so it can gate a deploy.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import sys
+
+# (label, path into a scenario, True if higher is better)
+FIELDS = [
+    ("throughput", ("throughput_images_per_s",), True),
+    ("p50 ms", ("latency_ms", "p50"), False),
+    ("p95 ms", ("latency_ms", "p95"), False),
+    ("p99 ms", ("latency_ms", "p99"), False),
+    ("peak rss MB", ("peak_rss_mb",), False),
+]
+
+
+def load(path: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    with open(path) as f:
+        report = json.load(f)
+    return {(scenario["name"], scenario["concurrency"]): scenario for scenario in report["scenarios"]}
+
+
+def lookup(scenario: Dict[str, Any], path: Tuple[str, ...]) -> float:
+    value: Any = scenario
+    for key in path:
+        value = value[key]
+    return float(value)
+
+
+def compare(baseline: Dict[Tuple[str, int], Dict[str, Any]], candidate: Dict[Tuple[str, int], Dict[str, Any]], threshold: float) -> Tuple[List[str], List[str]]:
+    """Return (table lines, regression descriptions)."""
+    lines = [f"{'scenario':>20} {'metric':>12} {'baseline':>12} {'candidate':>12} {'change':>9}"]
+    regressions = []
+    for key in sorted(set(baseline) & set(candidate)):
+        name = f"{key[0]} c={key[1]}"
+        for label, path, higher_is_better in FIELDS:
+            before, after = lookup(baseline[key], path), lookup(candidate[key], path)
+            change = (after - before) / before * 100 if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {label}: {before:g} -> {after:g} ({change:+.1f}%)")
+            lines.append(f"{name:>20} {label:>12} {before:12.2f} {after:12.2f} {change:+8.1f}%{flag}")
+    for key in sorted(set(baseline) ^ set(candidate)):
+        lines.append(f"{key[0]} c={key[1]}: only in {'baseline' if key in baseline else 'candidate'}")
+    return lines, regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed slowdown in percent (default: 10)")
+    args = parser.parse_args(argv)
+
+    lines, regressions = compare(load(args.baseline), load(args.candidate), args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:g}%:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+from typing import List, NamedTuple
+from PIL import Image, ImageDraw, ImageFilter
+import numpy as np
+import os
+
+# Bump when the generator changes so old corpora are not mixed with new ones
+CORPUS_VERSION = 1
+
+
+class ImageSpec(NamedTuple):
+    name: str
+    size: tuple
+    format: str
+    mode: str
+
+
+# Covers the paths that behave differently: JPEG draft decoding, alpha and
+# palette inputs that need conversion, and sizes on both sides of PREVIEW_SIZE
+# and of the tiled streaming threshold
+SPECS = [
+    ImageSpec("small_rgb", (320, 240), "JPEG", "RGB"),
+    ImageSpec("photo_rgb", (1024, 768), "JPEG", "RGB"),
+    ImageSpec("hd_rgb", (1920, 1080), "JPEG", "RGB"),
+    ImageSpec("product_rgba", (1200, 1200), "PNG", "RGBA"),
+    ImageSpec("portrait_rgb", (800, 1200), "PNG", "RGB"),
+    ImageSpec("grayscale", (1024, 1024), "PNG", "L"),
+    ImageSpec("palette", (640, 480), "PNG", "P"),
+    ImageSpec("web_rgb", (1280, 720), "WEBP", "RGB"),
+    ImageSpec("large_rgb", (4000, 3000), "JPEG", "RGB"),
+]
+
+EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+
+def render(spec: ImageSpec, seed: int) -> Image.Image:
+    """A gradient backdrop with a few blurred foreground shapes, drawn from seed."""
+    rng = np.random.default_rng(seed)
+    width, height = spec.size
+    start, end = rng.integers(0, 256, size=(2, 3))
+    ramp = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    backdrop = (start + (end - start) * ramp).repeat(height, axis=0)
+    noise = rng.normal(0, 6, size=(height, width, 3))
+    img = Image.fromarray(np.clip(backdrop + noise, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(img)
+    for _ in range(int(rng.integers(2, 6))):
+        x0, y0 = rng.integers(0, [width * 3 // 4, height * 3 // 4])
+        x1, y1 = x0 + rng.integers(width // 8, width // 2), y0 + rng.integers(height // 8, height // 2)
+        colour = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        if rng.random() < 0.5:
+            draw.ellipse((int(x0), int(y0), int(x1), int(y1)), fill=colour)
+        else:
+            draw.rectangle((int(x0), int(y0), int(x1), int(y1)), fill=colour)
+    img = img.filter(ImageFilter.GaussianBlur(radius=max(1, width // 400)))
+    if spec.mode == "RGBA":
+        alpha = Image.new("L", spec.size, 0)
+        ImageDraw.Draw(alpha).ellipse((width // 10, height // 10, width * 9 // 10, height * 9 // 10), fill=255)
+        img.putalpha(alpha)
+    elif spec.mode == "P":
+        img = img.quantize(colors=64, dither=Image.Dither.NONE)
+    elif spec.mode != "RGB":
+        img = img.convert(spec.mode)
+    return img
+
+
+def generate_corpus(out_dir: str, seed: int = 0, include_large: bool = True) -> List[str]:
+    """Write the corpus to out_dir (reusing files already there) and return the paths in a fixed order."""
+    corpus_dir = os.path.join(out_dir, f"v{CORPUS_VERSION}-seed{seed}")
+    os.makedirs(corpus_dir, exist_ok=True)
+    paths = []
+    for index, spec in enumerate(SPECS):
+        if not include_large and spec.size[0] * spec.size[1] > 4_000_000:
+            continue
+        path = os.path.join(corpus_dir, f"{spec.name}.{EXTENSIONS[spec.format]}")
+        if not os.path.exists(path):
+            img = render(spec, seed * 1000 + index)
+            options = {"quality": 90} if spec.format in ("JPEG", "WEBP") else {}
+            img.save(f"{path}.tmp", format=spec.format, **options)
+            os.replace(f"{path}.tmp", path)
+        paths.append(path)
+    return paths
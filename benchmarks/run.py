@@ -0,0 +1,322 @@
+"""Benchmark BackgroundRemover and the API in-process.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --scenarios remove_bg,batch_remove --concurrency 1,8 --requests 100 --output after.json
+    python -m benchmarks.compare before.json after.json
+
+Every scenario runs against the same deterministic corpus (see
+benchmarks/corpus.py) and reports throughput, latency percentiles, peak RSS
+of this process and where the time went per processing stage. The result
+cache is disabled unless --cache is given, so repeated images are really
+processed each time.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.corpus import CORPUS_VERSION, generate_corpus
+
+SCENARIOS = ("remover", "remove_bg", "remove_bg_full", "batch_remove")
+BATCH_SIZE = 10
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def current_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs (macOS): fall back to the lifetime peak
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RSSSampler:
+    """Tracks the peak resident set size of this process while active.
+
+    Process-mode inference workers are separate processes and not included.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self.peak = current_rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info: Any):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+
+
+def stage_snapshot() -> Dict[str, Tuple[float, int]]:
+    from src.services import metrics
+    return {key[0]: value for key, value in metrics.STAGE_SECONDS.snapshot().items()}
+
+
+def stage_breakdown(before: Dict[str, Tuple[float, int]], after: Dict[str, Tuple[float, int]], images: int) -> Dict[str, Dict[str, float]]:
+    stages = {}
+    for name, (total, count) in sorted(after.items()):
+        total -= before.get(name, (0.0, 0))[0]
+        count -= before.get(name, (0.0, 0))[1]
+        if count:
+            stages[name] = {
+                "total_seconds": round(total, 4),
+                "calls": count,
+                "ms_per_image": round(total * 1000 / max(images, 1), 3),
+            }
+    return stages
+
+
+def summarize(
+    name: str,
+    concurrency: int,
+    latencies: List[float],
+    errors: Dict[str, int],
+    wall_seconds: float,
+    images: int,
+    peak_rss: int,
+    stages: Dict[str, Dict[str, float]],
+) -> Dict[str, Any]:
+    ordered = sorted(latencies)
+    return {
+        "name": name,
+        "concurrency": concurrency,
+        "requests": len(latencies) + sum(errors.values()),
+        "images": images,
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_images_per_s": round(images / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ordered) * 1000 / len(ordered), 3) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        },
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+        "stages": stages,
+    }
+
+
+async def drive(
+    concurrency: int, total: int, call: Callable[[int], Awaitable[Optional[str]]]
+) -> Tuple[List[float], Dict[str, int], float]:
+    """Run call(0..total-1) with `concurrency` in flight; call returns an error label or None."""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    next_index = iter(range(total))
+
+    async def worker():
+        for index in next_index:
+            start_time = time.perf_counter()
+            error = await call(index)
+            if error:
+                errors[error] = errors.get(error, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start_time
+
+
+def bench_remover(paths: List[str], model: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    """Call BackgroundRemover.process_bytes directly from a thread pool."""
+    from src.services.background_remover import BackgroundRemover
+
+    remover = BackgroundRemover(model_name=model)
+    contents = [read_bytes(path) for path in paths]
+    remover.process_bytes(contents[0])
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def call(index: int) -> Optional[str]:
+        try:
+            await asyncio.get_running_loop().run_in_executor(pool, remover.process_bytes, contents[index % len(contents)])
+        except Exception as e:
+            return type(e).__name__
+        return None
+
+    before = stage_snapshot()
+    with RSSSampler() as rss:
+        latencies, errors, wall = asyncio.run(drive(concurrency, requests, call))
+    pool.shutdown()
+    return summarize("remover", concurrency, latencies, errors, wall, len(latencies), rss.peak,
+                     stage_breakdown(before, stage_snapshot(), len(latencies)))
+
+
+async def bench_app(paths: List[str], scenarios: List[str], concurrencies: List[int], requests: int, model: str) -> List[Dict[str, Any]]:
+    """Drive the FastAPI app through httpx's ASGI transport, lifespan included."""
+    import httpx
+    from src import server
+
+    results = []
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            deadline = time.time() + 300
+            while (await client.get("/health")).status_code != 200:
+                if time.time() > deadline:
+                    raise RuntimeError("Models did not become ready within 300 seconds")
+                await asyncio.sleep(0.1)
+
+            async def remove_bg(index: int, resolution: str) -> Optional[str]:
+                response = await client.post("/remove_bg", data={
+                    "image_path": paths[index % len(paths)], "model": model, "resolution": resolution,
+                })
+                await response.aread()
+                return None if response.status_code == 200 else f"http_{response.status_code}"
+
+            async def batch_remove(index: int) -> Optional[str]:
+                files = [
+                    ("files", (os.path.basename(path), read_bytes(path)))
+                    for path in (paths[(index * BATCH_SIZE + i) % len(paths)] for i in range(BATCH_SIZE))
+                ]
+                response = await client.post("/batch_remove", files=files, data={"model": model})
+                if response.status_code != 200:
+                    return f"http_{response.status_code}"
+                failed = [item for item in response.json() if item["status"] != "success"]
+                return "item_error" if failed else None
+
+            calls = {
+                "remove_bg": (lambda index: remove_bg(index, "preview"), 1),
+                "remove_bg_full": (lambda index: remove_bg(index, "full"), 1),
+                "batch_remove": (batch_remove, BATCH_SIZE),
+            }
+            for name in scenarios:
+                call, images_per_call = calls[name]
+                for concurrency in concurrencies:
+                    before = stage_snapshot()
+                    with RSSSampler() as rss:
+                        latencies, errors, wall = await drive(concurrency, requests, call)
+                    images = len(latencies) * images_per_call
+                    results.append(summarize(name, concurrency, latencies, errors, wall, images, rss.peak,
+                                             stage_breakdown(before, stage_snapshot(), images)))
+                    print_result(results[-1])
+    return results
+
+
+def print_result(result: Dict[str, Any]):
+    latency = result["latency_ms"]
+    print(
+        f"{result['name']:>15} c={result['concurrency']:<3} {result['throughput_images_per_s']:8.2f} img/s  "
+        f"p50 {latency['p50']:8.1f}ms  p95 {latency['p95']:8.1f}ms  p99 {latency['p99']:8.1f}ms  "
+        f"rss {result['peak_rss_mb']:7.1f}MB  errors {sum(result['errors'].values())}",
+        file=sys.stderr,
+    )
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--scenarios", default="remover,remove_bg,batch_remove",
+                        help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per scenario and concurrency level")
+    parser.add_argument("--model", default="u2netp")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "pixelforge-bench-corpus"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-large", action="store_true", help="Leave the 12 megapixel image out of the corpus")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache enabled")
+    parser.add_argument("--verbose", action="store_true", help="Keep the server's per-request INFO logging")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    concurrencies = [int(value) for value in args.concurrency.split(",")]
+
+    # Server settings are read at import time
+    if not args.cache:
+        os.environ["RESULT_CACHE_MEMORY_MB"] = "0"
+        os.environ.pop("RESULT_CACHE_DIR", None)
+    os.environ.setdefault("MODELS", args.model)
+    os.environ.setdefault("JOB_DIR", tempfile.mkdtemp(prefix="pixelforge-bench-jobs-"))
+
+    paths = generate_corpus(args.corpus_dir, seed=args.seed, include_large=not args.no_large)
+    results = []
+    if "remover" in scenarios:
+        for concurrency in concurrencies:
+            results.append(bench_remover(paths, args.model, concurrency, args.requests))
+            print_result(results[-1])
+    app_scenarios = [name for name in scenarios if name != "remover"]
+    if app_scenarios:
+        from src import server  # noqa: F401  configures logging
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        results.extend(asyncio.run(bench_app(paths, app_scenarios, concurrencies, args.requests, args.model)))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "model": args.model,
+            "corpus": {"version": CORPUS_VERSION, "seed": args.seed, "images": [os.path.basename(p) for p in paths]},
+            "requests": args.requests,
+            "cache": args.cache,
+            "settings": {
+                name: value for name, value in os.environ.items()
+                if name.startswith(("INFERENCE_", "MICRO_BATCH_", "ONNX_", "MODELS", "MEMORY_BUDGET", "TILED_"))
+            },
+        },
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Preforking launcher: load the models once, then fork workers that share them.
+
+    python -m src.prefork
+
+The parent imports the app and loads and warms up every model before it
+forks, so each worker starts with ready sessions whose weights it shares with
+the parent and its siblings through copy-on-write pages, instead of paying for
+the imports and the model load itself. Workers listen on one shared socket; a
+worker that exits is replaced by a fresh fork of the parent, which is ready at
+once rather than after a cold start and takes over the batch jobs the dead
+worker owned.
+"""
+from typing import Dict, Optional
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from src.services import memory_budget, result_cache
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PREFORK_WORKERS = int(os.environ.get("PREFORK_WORKERS", os.cpu_count() or 1))
+
+# Sessions are created before fork() and ONNX Runtime's thread pools do not
+# survive it, so every session runs single-threaded; parallelism comes from
+# the worker processes and their executor threads instead
+os.environ["INFERENCE_EXECUTOR"] = "thread"
+os.environ["ONNX_INTRA_OP_THREADS"] = "1"
+os.environ.setdefault("INFERENCE_WORKERS", str(max(1, (os.cpu_count() or 1) // PREFORK_WORKERS)))
+# Every worker has its own memory budget and in-memory result cache, so split
+# the single-process defaults between them rather than multiplying them
+os.environ.setdefault("MEMORY_BUDGET_MB", str(max(1, memory_budget.DEFAULT_BUDGET_MB // PREFORK_WORKERS)))
+os.environ.setdefault("RESULT_CACHE_MEMORY_MB", str(max(1, result_cache.DEFAULT_MEMORY_MB // PREFORK_WORKERS)))
+
+from src import server  # noqa: E402
+from src.services import metrics  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+# A worker that dies sooner than this after starting is restarted with a delay
+MIN_WORKER_SECONDS = 1.0
+
+
+def spawn_worker(sock: socket.socket, resume_jobs: bool, replaces: Optional[int] = None) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    exit_code = 0
+    try:
+        server.job_manager.resume = resume_jobs
+        # Jobs the dead worker was running would otherwise wait for a full restart
+        server.job_manager.takeover_from = replaces
+        uvicorn.Server(uvicorn.Config(server.app)).run(sockets=[sock])
+    except BaseException as e:
+        logger.error(f"Worker {os.getpid()} failed: {str(e)}")
+        exit_code = 1
+    finally:
+        # os._exit() skips atexit, so flush the log queue here
+        server.log_listener.stop()
+        os._exit(exit_code)
+
+
+def main():
+    start_time = time.time()
+    server.registry.set_intra_op_threads(server.executor.intra_op_threads)
+    # Keep the warm-up image out of the stage histograms every worker inherits
+    metrics.timed_call(server.registry.warm_up)
+    logger.info(f"Models loaded in {time.time() - start_time:.2f} seconds: {server.registry.states}")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, server.PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # Only the first worker resumes jobs left over from the last run
+    workers: Dict[int, float] = {spawn_worker(sock, index == 0): time.time() for index in range(PREFORK_WORKERS)}
+    logger.info(f"Serving on {HOST}:{server.PORT} with {PREFORK_WORKERS} preforked workers")
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        pid, status = os.wait()
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        logger.warning(f"Worker {pid} exited with code {os.waitstatus_to_exitcode(status)}, starting a new one")
+        if time.time() - started < MIN_WORKER_SECONDS:
+            time.sleep(MIN_WORKER_SECONDS)
+        workers[spawn_worker(sock, False, replaces=pid)] = time.time()
+    sock.close()
+    logger.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
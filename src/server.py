@@ -1,87 +1,98 @@
-from typing import Optional, List
-from fastapi import FastAPI, Form, HTTPException, status, File, UploadFile
-from fastapi.responses import FileResponse, StreamingResponse
+from typing import Dict, Optional, List, Tuple
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Form, HTTPException, Request, status, File, UploadFile
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
+import asyncio
+import atexit
+import base64
+import io
 import logging
+import logging.handlers
+import queue
 from datetime import datetime
 import os
-import uuid
 import time
-from rembg import remove, new_session
 from PIL import Image
-import io
+from src.services import metrics
+from src.services.background_remover import (
+    OUTPUT_FORMATS, PREVIEW_SIZE, OutputOptions, encode_original_preview, has_alpha, iter_cutout_png, sniff_output_format
+)
+from src.services.inference_pool import InferenceExecutor, QueueFullError
+from src.services.job_manager import JobManager, result_filename
+from src.services.memory_budget import ImageTooLargeError, MemoryBudget, Reservation, image_info
+from src.services.micro_batcher import MicroBatcher
+from src.services.result_cache import ResultCache
+from src.services.sequence import ANIMATION_FORMATS, SequenceProcessor, SequenceSource
+from src.services.session_registry import SessionRegistry
 
 # Get port from environment variable for local use
 PORT = int(os.environ.get("PORT", 8000))
+# Upper limit on files per job; /batch_remove stays at 10
+JOB_MAX_FILES = int(os.environ.get("JOB_MAX_FILES", 1000))
+# Upper limit on frames per /sequence request
+SEQUENCE_MAX_FRAMES = int(os.environ.get("SEQUENCE_MAX_FRAMES", 1000))
+# Full-resolution cutouts above this size are streamed band by band instead of buffered
+TILED_MIN_PIXELS = int(float(os.environ.get("TILED_MIN_MEGAPIXELS", 12)) * 1_000_000)
+# Add a Server-Timing header with per-stage durations to every response
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("api.log"),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# BackgroundRemover class
-class BackgroundRemover:
-    def __init__(self, model_name: str = "u2netp"):
-        self.model_name = model_name
-        self.session = None
-
-    def _initialize_model(self):
-        if not self.session:
-            try:
-                self.session = new_session(self.model_name)
-                logger.info(f"Loaded model: {self.model_name}")
-            except Exception as e:
-                logger.error(f"Model loading failed: {str(e)}")
-                raise RuntimeError(f"Could not load model {self.model_name}") from e
+# Configure logging: request handlers only enqueue records, a listener thread
+# does the formatting and the file/console writes
+log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+log_handlers = [logging.FileHandler("api.log"), logging.StreamHandler()]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(lambda: log_listener.stop())
+# Attached directly rather than through basicConfig, which would give the
+# QueueHandler its default format and have every message formatted twice
+queue_handler = logging.handlers.QueueHandler(log_queue)
+root_logger = logging.getLogger()
+root_logger.addHandler(queue_handler)
+root_logger.setLevel(logging.INFO)
 
-    def process_image(self, input_data: bytes) -> bytes:
-        if not self.session:
-            self._initialize_model()
-        return remove(input_data, session=self.session)
+def restart_log_listener():
+    """A forked worker (src.prefork) inherits the queue but not the listener thread."""
+    global log_queue, log_listener
+    # The inherited queue can still hold the parent's records, which the parent
+    # writes itself, and the wait state of the parent's listener, which would
+    # leave a new listener blocked forever; start over with an empty one
+    log_queue = queue.SimpleQueue()
+    queue_handler.queue = log_queue
+    log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+    log_listener.start()
 
-    def process_and_save(self, input_path: str, output_path: Optional[str] = None) -> str:
-        try:
-            if not output_path:
-                output_path = f"result_{uuid.uuid4()}.png"
-            with Image.open(input_path) as img:
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-                img.thumbnail((500, 500), Image.Resampling.LANCZOS)
-                buffer = io.BytesIO()
-                img.save(buffer, format="PNG")
-                input_data = buffer.getvalue()
-            result = self.process_image(input_data)
-            with open(output_path, "wb") as f:
-                f.write(result)
-            return output_path
-        except Exception as e:
-            logger.error(f"Processing failed for {input_path}: {str(e)}")
-            raise
+os.register_at_fork(after_in_child=restart_log_listener)
+logger = logging.getLogger(__name__)
 
-    def validate_image(self, file_path: str, max_size_mb: int = 5) -> bool:
-        try:
-            if not os.path.exists(file_path):
-                raise ValueError("File does not exist")
-            if os.path.getsize(file_path) > max_size_mb * 1024 * 1024:
-                raise ValueError(f"File exceeds {max_size_mb}MB limit")
-            with Image.open(file_path) as img:
-                img.verify()
-            return True
-        except Exception as e:
-            logger.error(f"Validation failed for {file_path}: {str(e)}")
-            raise
+REQUEST_SECONDS = metrics.Histogram(
+    "pixelforge_request_seconds", "Time to produce a response, by route.", ["method", "path"]
+)
+REQUESTS = metrics.Counter(
+    "pixelforge_requests_total", "Responses sent, by route and status code.", ["method", "path", "status"]
+)
+QUEUE_DEPTH = metrics.Gauge("pixelforge_inference_queue_depth", "Inference calls queued or running.")
+QUEUE_CAPACITY = metrics.Gauge("pixelforge_inference_queue_capacity", "Inference calls admitted before returning 429.")
+MODEL_SESSIONS = metrics.Gauge("pixelforge_model_sessions", "Loaded ONNX sessions per model.", ["model"])
+MODEL_LOAD_SECONDS = metrics.Gauge("pixelforge_model_load_seconds", "Time to load and warm up each model.", ["model"])
+CACHE_REQUESTS = metrics.Counter("pixelforge_cache_requests_total", "Result cache lookups.", ["result"])
+CACHE_BYTES = metrics.Gauge("pixelforge_cache_bytes", "Bytes held by the result cache.", ["tier"])
+CACHE_ENTRIES = metrics.Gauge("pixelforge_cache_entries", "Entries held by the result cache.", ["tier"])
+SEQUENCE_FRAMES = metrics.Counter(
+    "pixelforge_sequence_frames_total", "Sequence frames cut out, by whether the model ran or a mask was reused.", ["result"]
+)
+MEMORY_BUDGET_BYTES = metrics.Gauge("pixelforge_memory_budget_bytes", "Decoded pixel memory budget.", ["state"])
 
 # Pydantic models
 class HealthCheck(BaseModel):
     status: str
     model: str
+    models: Dict[str, str]
     version: str
     timestamp: str
 
@@ -91,105 +102,763 @@ class BatchResult(BaseModel):
     download_url: Optional[str] = None
     error: Optional[str] = None
 
+class ImageMetadata(BaseModel):
+    size: float
+    width: int
+    height: int
+    format: Optional[str] = None
+
+class ProcessResult(BaseModel):
+    result_id: str
+    filename: str
+    model: str
+    resolution: str
+    cache: str
+    metadata: ImageMetadata
+    cutout: str
+    cutout_media_type: str
+    original: Optional[str] = None
+    original_media_type: Optional[str] = None
+
+class JobItem(BaseModel):
+    index: int
+    filename: str
+    status: str
+    download_url: Optional[str] = None
+    error: Optional[str] = None
+
+class JobStatus(BaseModel):
+    job_id: str
+    model: str
+    status: str
+    total: int
+    queued: int
+    processing: int
+    done: int
+    error: int
+    results_url: str
+    events_url: str
+    items: Optional[List[JobItem]] = None
+
 # Initialize service
-remover = BackgroundRemover(model_name="u2netp")
+registry = SessionRegistry.from_env()
+executor = InferenceExecutor.from_env(registry)
+batcher = MicroBatcher.from_env(executor)
+result_cache = ResultCache.from_env()
+memory_budget = MemoryBudget.from_env()
+job_manager = JobManager.from_env(executor, memory_budget)
+sequence_processor = SequenceProcessor.from_env(executor)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executor.start()
+    # Warm up in the background so /health can report "loading" meanwhile
+    warm_up = asyncio.create_task(executor.warm_up())
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    warm_up.cancel()
+    executor.shutdown()
 
 # FastAPI app
 app = FastAPI(
     title="PixelForge BG Removal API",
     version="1.0.0",
-    docs_url="/docs"
+    docs_url="/docs",
+    lifespan=lifespan
+)
+
+# Encoded images and archives do not shrink under gzip; compressing them only burns CPU
+app.add_middleware(
+    GZipMiddleware,
+    exclude_content_types=(
+        "image/png", "image/apng", "image/webp", "image/avif", "image/jpeg", "image/gif",
+        "application/zip", "multipart/mixed", "text/event-stream",
+    )
 )
 
-app.add_middleware(GZipMiddleware)
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    start_time = time.perf_counter()
+    timings = metrics.start_request()
+    response = await call_next(request)
+    elapsed_time = time.perf_counter() - start_time
+    # Label by route template so ids in the URL do not explode the series count
+    route = request.scope.get("route")
+    path = route.path if route else "unmatched"
+    REQUEST_SECONDS.observe(elapsed_time, method=request.method, path=path)
+    REQUESTS.inc(method=request.method, path=path, status=response.status_code)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed_time)
+    return response
+
+def queue_full(e: QueueFullError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Server is busy, please retry later",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def too_large(e: ImageTooLargeError) -> HTTPException:
+    return HTTPException(status_code=413, detail=str(e))
+
+def reserve_memory(needed: int) -> Reservation:
+    if not memory_budget.try_acquire(needed):
+        raise QueueFullError(executor.retry_after())
+    return Reservation(memory_budget, needed)
+
+def read_file(path: str) -> bytes:
+    with metrics.stage("io"), open(path, "rb") as f:
+        return f.read()
+
+def check_image_path(image_path: str):
+    if not image_path or not isinstance(image_path, str):
+        raise HTTPException(status_code=400, detail="Invalid image path provided")
+    if not os.path.exists(image_path):
+        raise HTTPException(status_code=400, detail="Image path does not exist on server")
+
+def read_metadata(content: bytes) -> Tuple[ImageMetadata, str]:
+    """Header-only metadata plus the media type of the original file."""
+    with metrics.stage("validate"), Image.open(io.BytesIO(content)) as img:
+        metadata = ImageMetadata(size=round(len(content) / 1024, 2), width=img.width, height=img.height, format=img.format)
+        return metadata, Image.MIME.get(img.format, "application/octet-stream")
+
+def original_preview(content: bytes) -> Tuple[bytes, str]:
+    """encode_original_preview() for a cached cutout, whose original was never decoded."""
+    with metrics.stage("decode"), Image.open(io.BytesIO(content)) as img:
+        img.draft("RGB", PREVIEW_SIZE)
+        img = img.convert("RGBA" if has_alpha(img) else "RGB")
+    return encode_original_preview(img)
+
+def write_file(path: str, content: bytes):
+    with metrics.stage("io"):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+
+def cache_key(
+    content: bytes, model: str, resolution: str = "preview", refine: bool = False, output: Optional[OutputOptions] = None
+) -> str:
+    size = "500x500" if resolution == "preview" else "full"
+    output = output or OutputOptions()
+    return ResultCache.make_key(
+        content, model, size=size, refine=refine, format=output.format, quality=output.quality,
+        compress_level=output.compress_level, mask_only=output.mask_only
+    )
+
+def streams_full(width: int, height: int, output: OutputOptions) -> bool:
+    # Only PNG can be encoded band by band; other formats take the buffered path
+    return output.format == "png" and width * height >= TILED_MIN_PIXELS
+
+def resolve_output(output_format: str, output_quality: Optional[int], compress_level: Optional[int], mask_only: bool) -> OutputOptions:
+    try:
+        return OutputOptions(output_format.lower(), output_quality, compress_level, mask_only).validate()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def result_headers(filename: str, output: OutputOptions, **extra: str) -> Dict[str, str]:
+    return {"Content-Disposition": f"attachment; filename={result_filename(filename, output.extension)}", **extra}
+
+MULTIPART_BOUNDARY = "pixelforge-result"
+
+def multipart_headers(filename: str, media_type: str = "image/png", length: Optional[int] = None) -> bytes:
+    headers = (
+        f"--{MULTIPART_BOUNDARY}\r\n"
+        f"Content-Type: {media_type}\r\n"
+        f"Content-Disposition: attachment; filename={filename}\r\n"
+    )
+    if length is not None:
+        headers += f"Content-Length: {length}\r\n"
+    return (headers + "\r\n").encode()
+
+def multipart_part(content: bytes, filename: str, media_type: str = "image/png") -> bytes:
+    return multipart_headers(filename, media_type, len(content)) + content + b"\r\n"
+
+async def progressive_parts(
+    content: bytes, model_name: str, refine: bool, filename: str, reservation: Reservation, output: OutputOptions,
+    tiled: bool = False
+):
+    """Yield the preview cutout as soon as it exists, then the full-resolution
+    one, streamed band by band when tiled."""
+    try:
+        mask = None
+        result_name = result_filename(filename, output.extension)
+        preview_key = await run_in_threadpool(cache_key, content, model_name, "preview", False, output)
+        preview = await run_in_threadpool(result_cache.get, preview_key)
+        if preview is None:
+            preview, mask = await executor.run(
+                "process_preview", content, output, model=model_name, on_done=reservation.hold()
+            )
+            await run_in_threadpool(result_cache.put, preview_key, preview)
+        yield multipart_part(preview, f"preview_{result_name}", output.media_type)
+
+        if tiled:
+            if mask is None:
+                mask = await executor.run("predict_mask", content, model=model_name, on_done=reservation.hold())
+            yield multipart_headers(result_name, output.media_type)
+            async for chunk in iterate_in_threadpool(iter_cutout_png(content, mask, refine, output=output)):
+                yield chunk
+            yield f"\r\n--{MULTIPART_BOUNDARY}--\r\n".encode()
+            return
+
+        full_key = await run_in_threadpool(cache_key, content, model_name, "full", refine, output)
+        full = await run_in_threadpool(result_cache.get, full_key)
+        if full is None:
+            full = await executor.run(
+                "process_full", content, mask, refine, output, model=model_name, on_done=reservation.hold()
+            )
+            await run_in_threadpool(result_cache.put, full_key, full)
+        yield multipart_part(full, result_name, output.media_type)
+        yield f"--{MULTIPART_BOUNDARY}--\r\n".encode()
+    except Exception as e:
+        # Headers are already sent; the client sees a stream without the closing boundary
+        logger.error(f"Progressive processing failed for {filename}: {str(e)}")
+    finally:
+        reservation.release()
+
+async def stream_large_cutout(image_path: str, filename: str, model_name: str, refine: bool, needed: int, output: OutputOptions):
+    """Run the model on a reduced decode, then stream the full-resolution cutout
+    band by band so neither the RGBA result nor its encoding is ever held whole."""
+    reservation = reserve_memory(needed)
+    try:
+        mask = await executor.run("predict_mask", image_path, model=model_name, on_done=reservation.hold())
+    except BaseException:
+        reservation.release()
+        raise
+
+    def chunks():
+        try:
+            yield from iter_cutout_png(image_path, mask, refine, output=output)
+        except Exception as e:
+            logger.error(f"Streaming cutout failed for {filename}: {str(e)}")
+        finally:
+            reservation.release()
+
+    logger.info(f"Streaming full-resolution cutout of {filename}")
+    return StreamingResponse(chunks(), media_type=output.media_type, headers=result_headers(filename, output))
+
+async def cached_cutout(
+    content: bytes, model_name: str, resolution: str, refine: bool, needed: int, output: OutputOptions,
+    reservation: Optional[Reservation] = None, with_original: bool = False
+) -> Tuple[str, bytes, str, Optional[Tuple[bytes, str]]]:
+    """Return (result id, encoded cutout, "HIT"/"MISS", original preview),
+    running the model only on a cache miss.
+
+    needed bytes are reserved for the model run unless the caller already
+    holds a reservation covering it. With with_original, the preview-sized
+    original (bytes, media type) comes from the same decode as the cutout.
+    """
+    key = await run_in_threadpool(cache_key, content, model_name, resolution, refine, output)
+    result = await run_in_threadpool(result_cache.get, key)
+    if result is not None:
+        original = await run_in_threadpool(original_preview, content) if with_original else None
+        return key, result, "HIT", original
+    original = None
+    held = reservation or reserve_memory(needed)
+    try:
+        if with_original:
+            result, original = await executor.run(
+                "process_with_original", content, resolution, refine, output, model=model_name, on_done=held.hold()
+            )
+        elif resolution == "full":
+            result = await executor.run(
+                "process_full", content, None, refine, output, model=model_name, on_done=held.hold()
+            )
+        else:
+            result = await batcher.process(content, model_name, output, held)
+    finally:
+        if reservation is None:
+            held.release()
+    await run_in_threadpool(result_cache.put, key, result)
+    return key, result, "MISS", original
+
+def resolve_model(model: Optional[str], quality: Optional[str]) -> str:
+    try:
+        return registry.resolve(model, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/health", response_model=HealthCheck)
-async def health_check():
+async def health_check(response: Response):
+    states = registry.states.values()
+    if registry.ready:
+        health_status = "healthy"
+    elif "failed" in states:
+        health_status = "unhealthy"
+    else:
+        health_status = "loading"
+    if health_status != "healthy":
+        # Keep load balancers away until every model is warm
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
     return {
-        "status": "healthy",
-        "model": remover.model_name,
+        "status": health_status,
+        "model": registry.default_model,
+        "models": registry.states,
         "version": app.version,
         "timestamp": datetime.now().isoformat()
     }
 
 @app.post("/remove_bg")
-async def remove_background(image_path: str = Form(...)):
+async def remove_background(
+    image_path: str = Form(...),
+    model: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    resolution: str = Form("preview"),
+    refine: bool = Form(False),
+    progressive: bool = Form(False),
+    output_format: str = Form("png"),
+    output_quality: Optional[int] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    mask_only: bool = Form(False)
+):
     start_time = time.time()
     logger.info(f"Received image_path: {image_path}")
     try:
-        if not image_path or not isinstance(image_path, str):
-            raise HTTPException(status_code=400, detail="Invalid image path provided")
-        if not os.path.exists(image_path):
-            raise HTTPException(status_code=400, detail="Image path does not exist on server")
-        if os.path.getsize(image_path) > 5 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File exceeds 5MB limit")
+        check_image_path(image_path)
+        if resolution not in ("preview", "full"):
+            raise HTTPException(status_code=400, detail="Resolution must be 'preview' or 'full'")
+        model_name = resolve_model(model, quality)
+        output = resolve_output(output_format, output_quality, compress_level, mask_only)
+        filename = os.path.basename(image_path)
+        width, height, image_format = await run_in_threadpool(image_info, image_path)
+        tiled = streams_full(width, height, output)
+        if resolution == "full" or progressive:
+            needed = memory_budget.check(width, height, "tiled" if tiled else "full")
+        else:
+            needed = memory_budget.check(width, height, "decode", image_format)
 
-        temp_id = uuid.uuid4()
-        output_path = os.path.join(os.getcwd(), f"result_{temp_id}.png")
+        if resolution == "full" and not progressive and tiled:
+            return await stream_large_cutout(image_path, filename, model_name, refine, needed, output)
 
-        remover.validate_image(image_path)
-        result_path = remover.process_and_save(image_path, output_path)
+        content = await run_in_threadpool(read_file, image_path)
+        if progressive:
+            if not executor.has_capacity():
+                raise QueueFullError(executor.retry_after())
+            reservation = reserve_memory(needed)
+            return StreamingResponse(
+                progressive_parts(content, model_name, refine, filename, reservation, output, tiled),
+                media_type=f"multipart/mixed; boundary={MULTIPART_BOUNDARY}"
+            )
+
+        key, result, cache_status, _ = await cached_cutout(content, model_name, resolution, refine, needed, output)
 
         elapsed_time = time.time() - start_time
-        logger.info(f"Processed {os.path.basename(image_path)} in {elapsed_time:.2f} seconds")
+        logger.info(f"Processed {filename} with {model_name} at {resolution} resolution in {elapsed_time:.2f} seconds (cache {cache_status.lower()})")
 
-        def cleanup_response():
-            yield from open(result_path, "rb")
-            if os.path.exists(result_path):
-                os.remove(result_path)
-                logger.info(f"Cleaned up temporary file: {result_path}")
+        return Response(
+            content=result,
+            media_type=output.media_type,
+            headers=result_headers(filename, output, **{"X-Cache": cache_status})
+        )
+    except HTTPException as e:
+        logger.error(f"HTTP error: {str(e.detail)}")
+        raise
+    except ImageTooLargeError as e:
+        logger.error(f"Rejected {image_path}: {str(e)}")
+        raise too_large(e)
+    except QueueFullError as e:
+        logger.warning(f"Rejected {image_path}: {str(e)}")
+        raise queue_full(e)
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/process", response_model=ProcessResult)
+async def process_image(
+    image_path: str = Form(...),
+    model: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    resolution: str = Form("preview"),
+    refine: bool = Form(False),
+    include_original: bool = Form(False),
+    output_format: str = Form("png"),
+    output_quality: Optional[int] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    mask_only: bool = Form(False)
+):
+    """Cutout, metadata and optionally a preview of the original in one round trip.
+
+    The file is read once, its header parsed once and its pixels decoded
+    once for both the cutout and the original's preview; the cutout is kept
+    in the result cache under result_id so /save_result can write it to
+    disk without the client uploading it again.
+    """
+    start_time = time.time()
+    logger.info(f"Received process request for: {image_path}")
+    try:
+        check_image_path(image_path)
+        if resolution not in ("preview", "full"):
+            raise HTTPException(status_code=400, detail="Resolution must be 'preview' or 'full'")
+        model_name = resolve_model(model, quality)
+        output = resolve_output(output_format, output_quality, compress_level, mask_only)
+        filename = os.path.basename(image_path)
+        content = await run_in_threadpool(read_file, image_path)
+        metadata, _ = await run_in_threadpool(read_metadata, content)
+        reservation = None
+        if resolution == "full":
+            if metadata.width * metadata.height >= TILED_MIN_PIXELS:
+                raise ImageTooLargeError(
+                    f"Image of {metadata.width}x{metadata.height} is too large to return inline at full resolution; "
+                    f"use /remove_bg with resolution=full, which streams it"
+                )
+            # The cutout is held again as base64 and inside the JSON body
+            reservation = reserve_memory(memory_budget.check(metadata.width, metadata.height, "process"))
+            needed = reservation.nbytes
+        else:
+            needed = memory_budget.check(metadata.width, metadata.height, "decode", metadata.format)
 
-        response = StreamingResponse(cleanup_response(), media_type="image/png")
-        response.headers["Content-Disposition"] = f"attachment; filename=no_bg_{os.path.basename(image_path)}"
-        return response
+        try:
+            key, result, cache_status, preview = await cached_cutout(
+                content, model_name, resolution, refine, needed, output, reservation, with_original=include_original
+            )
+            cutout = await run_in_threadpool(base64.b64encode, result)
+            original, original_media_type = None, None
+            if preview:
+                original = await run_in_threadpool(base64.b64encode, preview[0])
+                original_media_type = preview[1]
+        finally:
+            if reservation:
+                reservation.release()
+
+        elapsed_time = time.time() - start_time
+        logger.info(f"Processed {filename} with {model_name} at {resolution} resolution in {elapsed_time:.2f} seconds (cache {cache_status.lower()})")
+        return ProcessResult(
+            result_id=key,
+            filename=filename,
+            model=model_name,
+            resolution=resolution,
+            cache=cache_status,
+            metadata=metadata,
+            cutout=cutout.decode("ascii"),
+            cutout_media_type=output.media_type,
+            original=original.decode("ascii") if original else None,
+            original_media_type=original_media_type
+        )
     except HTTPException as e:
         logger.error(f"HTTP error: {str(e.detail)}")
         raise
+    except ImageTooLargeError as e:
+        logger.error(f"Rejected {image_path}: {str(e)}")
+        raise too_large(e)
+    except QueueFullError as e:
+        logger.warning(f"Rejected {image_path}: {str(e)}")
+        raise queue_full(e)
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/batch_remove", response_model=List[BatchResult])
-async def batch_remove(files: List[UploadFile] = File(...)):
+async def batch_remove(
+    files: List[UploadFile] = File(...),
+    model: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    output_format: str = Form("png"),
+    output_quality: Optional[int] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    mask_only: bool = Form(False)
+):
     if len(files) > 10:
         raise HTTPException(status_code=400, detail="Maximum 10 files per batch")
-    results = []
-    for file in files:
-        start_time = time.time()
+    model_name = resolve_model(model, quality)
+    output = resolve_output(output_format, output_quality, compress_level, mask_only)
+    if not executor.has_capacity():
+        raise queue_full(QueueFullError(executor.retry_after()))
+    start_time = time.time()
+    results: List[Optional[BatchResult]] = [None] * len(files)
+    contents = []
+    content_keys = []
+    content_indexes = []
+    needed = 0
+    for index, file in enumerate(files):
+        content = await file.read()
         try:
-            temp_id = uuid.uuid4()
-            input_path = f"temp_{temp_id}.png"
-            output_path = f"result_{temp_id}.png"
-            with open(input_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
-            remover.validate_image(input_path)
-            result_path = remover.process_and_save(input_path, output_path)
-            elapsed_time = time.time() - start_time
-            logger.info(f"Processed {file.filename} in batch in {elapsed_time:.2f} seconds")
-            results.append(BatchResult(
-                filename=file.filename,
-                status="success",
-                download_url=f"/download/{os.path.basename(result_path)}"
-            ))
+            width, height, image_format = await run_in_threadpool(image_info, content)
+            file_needed = memory_budget.check(width, height, "decode", image_format)
         except Exception as e:
             logger.error(f"Batch processing failed for {file.filename}: {str(e)}")
-            results.append(BatchResult(
-                filename=file.filename,
-                status="error",
-                error=str(e)
-            ))
+            results[index] = BatchResult(filename=file.filename, status="error", error=str(e))
+            continue
+        key = await run_in_threadpool(cache_key, content, model_name, "preview", False, output)
+        if await run_in_threadpool(result_cache.get, key) is not None:
+            results[index] = BatchResult(filename=file.filename, status="success", download_url=f"/download/{key}")
+            continue
+        contents.append(content)
+        content_keys.append(key)
+        content_indexes.append(index)
+        needed += file_needed
+
+    outcomes = []
+    if contents:
+        if needed > memory_budget.total_bytes:
+            detail = f"Batch needs about {needed // (1024 * 1024)}MB to decode, over the {memory_budget.total_bytes // (1024 * 1024)}MB memory budget"
+            logger.error(f"Rejected batch: {detail}")
+            raise HTTPException(status_code=413, detail=detail)
+        try:
+            reservation = reserve_memory(needed)
+        except QueueFullError as e:
+            raise queue_full(e)
+        try:
+            # Spread over the idle workers rather than queueing the whole batch on one
+            outcomes = await batcher.process_many(contents, model_name, output, reservation)
         finally:
-            if os.path.exists(input_path):
-                os.remove(input_path)
+            reservation.release()
+    if outcomes and all(isinstance(outcome, QueueFullError) for outcome in outcomes):
+        raise queue_full(outcomes[0])
+    for index, key, outcome in zip(content_indexes, content_keys, outcomes):
+        filename = files[index].filename
+        if isinstance(outcome, Exception):
+            logger.error(f"Batch processing failed for {filename}: {str(outcome)}")
+            results[index] = BatchResult(filename=filename, status="error", error=str(outcome))
+            continue
+        await run_in_threadpool(result_cache.put, key, outcome)
+        results[index] = BatchResult(filename=filename, status="success", download_url=f"/download/{key}")
+    elapsed_time = time.time() - start_time
+    logger.info(f"Processed batch of {len(files)} in {elapsed_time:.2f} seconds")
     return results
 
-@app.get("/download/{filename}")
-async def download_file(filename: str):
-    file_path = f"result_{filename}.png"
-    if not os.path.exists(file_path):
+@app.post("/sequence")
+async def remove_sequence_background(
+    files: List[UploadFile] = File(...),
+    model: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None),
+    container: str = Form("zip"),
+    fps: float = Form(25),
+    output_format: str = Form("png"),
+    output_quality: Optional[int] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    mask_only: bool = Form(False)
+):
+    """Cut out every frame of an animated image, a ZIP of frames or several stills.
+
+    Frames are decoded, run through the model and encoded in a pipeline, and
+    frames that barely differ from the last one the model ran on reuse its
+    mask. container "zip" streams one image per frame as it is finished;
+    "webp" and "apng" return a single animation once every frame is done.
+    """
+    start_time = time.time()
+    container = container.lower()
+    if container != "zip" and container not in ANIMATION_FORMATS:
+        raise HTTPException(status_code=400, detail="Container must be 'zip', 'webp' or 'apng'")
+    if fps <= 0:
+        raise HTTPException(status_code=400, detail="Frame rate must be positive")
+    model_name = resolve_model(model, quality)
+    output = resolve_output(output_format, output_quality, compress_level, mask_only)
+    uploads = [(file.filename, await file.read()) for file in files]
+    try:
+        source = await run_in_threadpool(SequenceSource, uploads, round(1000 / fps))
+    except (ValueError, OSError) as e:
+        logger.error(f"Rejected sequence: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Could not read frames: {str(e)}")
+    if source.frame_count > SEQUENCE_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"Maximum {SEQUENCE_MAX_FRAMES} frames per sequence")
+    try:
+        if not executor.has_capacity():
+            raise QueueFullError(executor.retry_after())
+        frames_held = min(source.frame_count, sequence_processor.frames_in_flight())
+        if container != "zip":
+            # Every cut-out frame is kept until the animation is encoded
+            frames_held += source.frame_count
+        needed = memory_budget.estimate(*source.size, "frame") * frames_held
+        if needed > memory_budget.total_bytes:
+            raise ImageTooLargeError(
+                f"Sequence of {source.frame_count} frames at {source.size[0]}x{source.size[1]} needs about "
+                f"{needed // (1024 * 1024)}MB, over the {memory_budget.total_bytes // (1024 * 1024)}MB memory budget"
+            )
+        reservation = reserve_memory(needed)
+    except ImageTooLargeError as e:
+        logger.error(f"Rejected sequence: {str(e)}")
+        raise too_large(e)
+    except QueueFullError as e:
+        logger.warning(f"Rejected sequence: {str(e)}")
+        raise queue_full(e)
+    name = os.path.splitext(os.path.basename(files[0].filename or "sequence"))[0] if len(files) == 1 else "sequence"
+
+    if container == "zip":
+        async def chunks():
+            try:
+                async for chunk in sequence_processor.iter_zip(source, model_name, output):
+                    yield chunk
+                logger.info(f"Streamed {source.frame_count} frames of {name} with {model_name} in {time.time() - start_time:.2f} seconds")
+            except Exception as e:
+                # Headers are already sent; the client sees a truncated archive
+                logger.error(f"Sequence processing failed for {name}: {str(e)}")
+            finally:
+                reservation.release()
+
+        return StreamingResponse(
+            chunks(),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=no_bg_{name}.zip"}
+        )
+
+    try:
+        animation, summary = await sequence_processor.encode_animation(source, model_name, container, output)
+    except Exception as e:
+        logger.error(f"Sequence processing failed for {name}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        reservation.release()
+    logger.info(
+        f"Processed {summary['frames']} frames of {name} with {model_name} in {time.time() - start_time:.2f} seconds "
+        f"({summary['inferred']} inferred, {summary['reused']} reused)"
+    )
+    return Response(
+        content=animation,
+        media_type=ANIMATION_FORMATS[container][1],
+        headers={
+            "Content-Disposition": f"attachment; filename={result_filename(name, container)}",
+            "X-Sequence-Frames": str(summary["frames"]),
+            "X-Sequence-Inferred": str(summary["inferred"]),
+        }
+    )
+
+def check_result_id(result_id: str):
+    # Result ids end up in file names in the on-disk cache
+    if not ResultCache.is_valid_key(result_id):
+        raise HTTPException(status_code=400, detail="Invalid result id")
+
+@app.get("/download/{result_id}")
+async def download_file(result_id: str):
+    check_result_id(result_id)
+    result = await run_in_threadpool(result_cache.get, result_id)
+    if result is None:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(file_path, media_type="image/png", filename=f"no_bg_{filename}")
+    # The cache stores bare bytes, so recover the format from the result itself
+    output_format = sniff_output_format(result) or "png"
+    return Response(
+        content=result,
+        media_type=OUTPUT_FORMATS[output_format][1],
+        headers={"Content-Disposition": f"attachment; filename=no_bg_{result_id}.{output_format}"}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    QUEUE_DEPTH.set(executor.pending)
+    QUEUE_CAPACITY.set(executor.max_pending)
+    sessions_per_model = executor.workers if executor.mode == "process" else 1
+    for name, state in registry.states.items():
+        MODEL_SESSIONS.set(sessions_per_model if state == "ready" else 0, model=name)
+    for name, seconds in registry.load_seconds.items():
+        MODEL_LOAD_SECONDS.set(seconds, model=name)
+    stats = result_cache.stats()
+    CACHE_REQUESTS.set_total(stats["hits"], result="hit")
+    CACHE_REQUESTS.set_total(stats["misses"], result="miss")
+    for tier in ("memory", "disk"):
+        CACHE_BYTES.set(stats[f"{tier}_bytes"], tier=tier)
+        CACHE_ENTRIES.set(stats[f"{tier}_entries"], tier=tier)
+    SEQUENCE_FRAMES.set_total(sequence_processor.frames_inferred, result="inferred")
+    SEQUENCE_FRAMES.set_total(sequence_processor.frames_reused, result="reused")
+    MEMORY_BUDGET_BYTES.set(memory_budget.in_use, state="in_use")
+    MEMORY_BUDGET_BYTES.set(memory_budget.total_bytes, state="total")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return result_cache.stats()
+
+def job_status(job: dict, items: Optional[List[dict]] = None) -> JobStatus:
+    job_id = job["id"]
+    return JobStatus(
+        job_id=job_id,
+        model=job["model"],
+        status=job["status"],
+        total=job["total"],
+        queued=job["queued"],
+        processing=job["processing"],
+        done=job["done"],
+        error=job["error"],
+        results_url=f"/jobs/{job_id}/results.zip",
+        events_url=f"/jobs/{job_id}/events",
+        items=None if items is None else [
+            JobItem(
+                index=item["idx"],
+                filename=item["filename"],
+                status=item["status"],
+                download_url=f"/jobs/{job_id}/items/{item['idx']}" if item["status"] == "done" else None,
+                error=item["error"]
+            )
+            for item in items
+        ]
+    )
+
+async def get_job_or_404(job_id: str) -> dict:
+    job = await run_in_threadpool(job_manager.store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def create_job(
+    files: List[UploadFile] = File(...),
+    model: Optional[str] = Form(None),
+    quality: Optional[str] = Form(None)
+):
+    if len(files) > JOB_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Maximum {JOB_MAX_FILES} files per job")
+    model_name = resolve_model(model, quality)
+    # Copied from the parser's spooled files into the job directory, so the
+    # uploads are never all held in memory at once
+    uploads = [(file.filename, file.file) for file in files]
+    job_id = await run_in_threadpool(job_manager.create, model_name, uploads)
+    job_manager.enqueue(job_id)
+    logger.info(f"Queued job {job_id} with {len(files)} files for {model_name}")
+    return job_status(await get_job_or_404(job_id))
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = await get_job_or_404(job_id)
+    return job_status(job, await run_in_threadpool(job_manager.store.get_items, job_id))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    await get_job_or_404(job_id)
+
+    async def events():
+        sent: Dict[int, str] = {}
+        while True:
+            job = await run_in_threadpool(job_manager.store.get_job, job_id)
+            if job is None:
+                yield "event: deleted\ndata: {}\n\n"
+                return
+            for item in await run_in_threadpool(job_manager.store.get_items, job_id):
+                if sent.get(item["idx"]) == item["status"]:
+                    continue
+                sent[item["idx"]] = item["status"]
+                yield f"event: item\ndata: {job_status(job, [item]).items[0].model_dump_json()}\n\n"
+            yield f"event: job\ndata: {job_status(job).model_dump_json(exclude={'items'})}\n\n"
+            if job["status"] == "done":
+                return
+            if not await job_manager.wait_for_update(job_id, timeout=15):
+                # Keep proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/jobs/{job_id}/items/{index}")
+async def get_job_item(job_id: str, index: int):
+    item = await run_in_threadpool(job_manager.store.get_item, job_id, index)
+    if item is None or item["status"] != "done":
+        raise HTTPException(status_code=404, detail="Result not found")
+    return FileResponse(
+        item["result_path"],
+        media_type="image/png",
+        headers={"Content-Disposition": f"attachment; filename={result_filename(item['filename'])}"}
+    )
+
+@app.get("/jobs/{job_id}/results.zip")
+async def get_job_results(job_id: str):
+    await get_job_or_404(job_id)
+    return StreamingResponse(
+        job_manager.iter_zip(job_id),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=job_{job_id}.zip"}
+    )
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    if not await run_in_threadpool(job_manager.delete, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"message": f"Job {job_id} deleted"}
 
 @app.post("/save_image")
 async def save_image(file: UploadFile = File(...), save_path: str = Form(None)):
@@ -198,9 +867,7 @@ async def save_image(file: UploadFile = File(...), save_path: str = Form(None)):
         content = await file.read()
         if not save_path:
             raise HTTPException(status_code=400, detail="Save path not provided")
-        os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
-        with open(save_path, "wb") as f:
-            f.write(content)
+        write_file(save_path, content)
         logger.info(f"Image saved to: {save_path}")
         return {"message": f"Image saved to {save_path}"}
     except HTTPException as e:
@@ -210,6 +877,27 @@ async def save_image(file: UploadFile = File(...), save_path: str = Form(None)):
         logger.error(f"Save failed: {str(e)}")
         raise HTTPException(status_code=422, detail=str(e))
 
+@app.post("/save_result")
+async def save_result(result_id: str = Form(...), save_path: str = Form(None)):
+    """Write an already computed result to disk, saving the client an upload."""
+    logger.info(f"Received save_path: {save_path} for result {result_id}")
+    try:
+        if not save_path:
+            raise HTTPException(status_code=400, detail="Save path not provided")
+        check_result_id(result_id)
+        result = await run_in_threadpool(result_cache.get, result_id)
+        if result is None:
+            raise HTTPException(status_code=404, detail="Result not found or expired, upload it to /save_image instead")
+        await run_in_threadpool(write_file, save_path, result)
+        logger.info(f"Result {result_id} saved to: {save_path}")
+        return {"message": f"Image saved to {save_path}"}
+    except HTTPException as e:
+        logger.error(f"HTTP error: {str(e.detail)}")
+        raise
+    except Exception as e:
+        logger.error(f"Save failed: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+
 @app.post("/get_metadata")
 async def get_metadata(image_path: str = Form(...)):
     logger.info(f"Received metadata request for: {image_path}")
@@ -233,9 +921,9 @@ async def get_original(image_path: str = Form(...)):
     try:
         if not os.path.exists(image_path):
             raise HTTPException(status_code=400, detail="Image path does not exist on server")
-        if os.path.getsize(image_path) > 5 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File exceeds 5MB limit")
         with Image.open(image_path) as img:
+            # Rejects only what no path could process
+            memory_budget.check(*img.size, "tiled")
             img.verify()
         return FileResponse(
             image_path,
@@ -245,6 +933,9 @@ async def get_original(image_path: str = Form(...)):
     except HTTPException as e:
         logger.error(f"HTTP error: {str(e.detail)}")
         raise
+    except ImageTooLargeError as e:
+        logger.error(f"Original retrieval failed: {str(e)}")
+        raise too_large(e)
     except Exception as e:
         logger.error(f"Original retrieval failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -1,66 +1,574 @@
-from typing import Optional
-from rembg import remove, new_session
-from PIL import Image
+from typing import TYPE_CHECKING, Any, Iterator, List, NamedTuple, Optional, Tuple, Union
+from PIL import Image, features
+import numpy as np
+import threading
+import hashlib
 import logging
+import platform
+import uuid
 import os
 import io
 
+from src.services.memory_budget import MemoryBudget
+from src.services.metrics import stage
+from src.services.png_stream import StreamingPNGWriter
+
+# rembg (which pulls in pymatting, scipy and numba) and onnxruntime take most
+# of the server's import time, so they are only imported once a model loads
+if TYPE_CHECKING:
+    import onnxruntime as ort
+
+# pymatting (imported by rembg, used only for alpha matting, which this service
+# never enables) starts numba's thread pool at import. With the TBB layer that
+# pool hangs interpreter exit when started off the main thread, as the lazy
+# import is, and after fork(); the workqueue layer does neither
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
 logger = logging.getLogger(__name__)
 
+# Anything decode() accepts: encoded bytes, a file path or an already opened image
+ImageSource = Union[bytes, str, Image.Image]
+
+# (mean, std, input size) used by rembg for models whose graph accepts a batch
+# dimension; other models fall back to one session.predict() call per image
+BATCH_INPUT_SPECS = {
+    "u2net": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2netp": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "u2net_human_seg": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "silueta": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    "isnet-general-use": ((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+# Longest edge the model input is prepared from and previews are returned at
+PREVIEW_SIZE = (500, 500)
+
+# Output format -> (Pillow format, media type)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif"),
+}
+
+# Encoder effort unless the request overrides it. Previews favour encode speed
+# (PNG level 1 is ~3x faster than level 6 for ~25% more bytes); full-resolution
+# results are usually saved, so they favour size.
+ENCODER_DEFAULTS = {
+    "preview": {"PNG": {"compress_level": 1}, "WEBP": {"method": 1}, "AVIF": {"speed": 8}},
+    "full": {"PNG": {"compress_level": 6}, "WEBP": {"method": 4}, "AVIF": {"speed": 6}},
+}
+
+
+class OutputOptions(NamedTuple):
+    """How a result is encoded.
+
+    WebP is lossless unless a quality is given; AVIF is always lossy (Pillow's
+    default quality 75). compress_level only applies to PNG. mask_only returns
+    the single-channel alpha mask instead of the cutout, for clients that
+    composite it over the original themselves; WebP has no grayscale mode, so
+    it is only available as PNG or AVIF.
+    """
+
+    format: str = "png"
+    quality: Optional[int] = None
+    compress_level: Optional[int] = None
+    mask_only: bool = False
+
+    def validate(self) -> "OutputOptions":
+        if self.format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format '{self.format}', choose one of {', '.join(OUTPUT_FORMATS)}")
+        if self.format == "avif" and not features.check("avif"):
+            raise ValueError("AVIF output is not supported by this server's Pillow build")
+        if self.mask_only and self.format == "webp":
+            raise ValueError("mask_only is only available as PNG or AVIF (WebP would return the mask as RGB)")
+        if self.quality is not None and not 1 <= self.quality <= 100:
+            raise ValueError("Output quality must be between 1 and 100")
+        if self.compress_level is not None and not 0 <= self.compress_level <= 9:
+            raise ValueError("PNG compression level must be between 0 and 9")
+        return self
+
+    @property
+    def media_type(self) -> str:
+        return OUTPUT_FORMATS[self.format][1]
+
+    @property
+    def extension(self) -> str:
+        return self.format
+
+
+def sniff_output_format(data: bytes) -> Optional[str]:
+    """Which OUTPUT_FORMATS entry encoded data, for results stored without metadata."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[4:12] in (b"ftypavif", b"ftypavis"):
+        return "avif"
+    return None
+
+
+def encode_image(img: Image.Image, output: OutputOptions, full: bool = False) -> bytes:
+    pil_format = OUTPUT_FORMATS[output.format][0]
+    options = dict(ENCODER_DEFAULTS["full" if full else "preview"][pil_format])
+    if pil_format == "PNG" and output.compress_level is not None:
+        options["compress_level"] = output.compress_level
+    elif pil_format == "WEBP":
+        if output.quality is None:
+            options["lossless"] = True
+        else:
+            options["quality"] = output.quality
+            # Keep the alpha channel exact even when the colours are lossy
+            options["alpha_quality"] = 100
+    elif pil_format == "AVIF" and output.quality is not None:
+        options["quality"] = output.quality
+    with stage("encode"):
+        buffer = io.BytesIO()
+        img.save(buffer, format=pil_format, **options)
+        return buffer.getvalue()
+
+
+def apply_mask(img: Image.Image, mask: Image.Image) -> Image.Image:
+    """Cut img out with mask (same premultiplied colours as rembg's naive_cutout)."""
+    from rembg.bg import naive_cutout
+
+    with stage("composite"):
+        return naive_cutout(img, mask)
+
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+
+
+def encode_original_preview(img: Image.Image) -> Tuple[bytes, str]:
+    """img shrunk to PREVIEW_SIZE for the panel's before/after toggle; returns
+    the encoded bytes and media type (JPEG, or PNG when img has alpha)."""
+    if img.width > PREVIEW_SIZE[0] or img.height > PREVIEW_SIZE[1]:
+        with stage("resize"):
+            img = img.copy()
+            img.thumbnail(PREVIEW_SIZE, Image.Resampling.BILINEAR)
+    with stage("encode"):
+        buffer = io.BytesIO()
+        if img.mode == "RGBA":
+            img.save(buffer, format="PNG", compress_level=1)
+            return buffer.getvalue(), "image/png"
+        img.save(buffer, format="JPEG", quality=85)
+        return buffer.getvalue(), "image/jpeg"
+
+
+def _box_filter(values: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over a (2r+1)x(2r+1) window using an integral image, shrinking the
+    window at the borders."""
+    height, width = values.shape
+    integral = np.zeros((height + 1, width + 1), dtype=np.float64)
+    integral[1:, 1:] = values.cumsum(0).cumsum(1)
+    rows = np.arange(height)
+    cols = np.arange(width)
+    y0, y1 = np.clip(rows - radius, 0, height), np.clip(rows + radius + 1, 0, height)
+    x0, x1 = np.clip(cols - radius, 0, width), np.clip(cols + radius + 1, 0, width)
+    sums = (
+        integral[y1][:, x1] - integral[y0][:, x1]
+        - integral[y1][:, x0] + integral[y0][:, x0]
+    )
+    counts = np.outer(y1 - y0, x1 - x0)
+    return (sums / counts).astype(np.float32)
+
+
+def _guided_coefficients(
+    mask: Image.Image, guide_small: Image.Image, radius: int, eps: float
+) -> Tuple[Image.Image, Image.Image]:
+    """Fit the guided filter's per-pixel linear model (alpha ~ a * luminance + b)
+    at guide_small's size; returns the smoothed a and b as float images."""
+    guide = np.asarray(guide_small, dtype=np.float32) / 255
+    mask_small = np.asarray(mask.resize(guide_small.size, Image.Resampling.BILINEAR), dtype=np.float32) / 255
+    mean_i = _box_filter(guide, radius)
+    mean_p = _box_filter(mask_small, radius)
+    cov_ip = _box_filter(guide * mask_small, radius) - mean_i * mean_p
+    var_i = _box_filter(guide * guide, radius) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return Image.fromarray(_box_filter(a, radius)), Image.fromarray(_box_filter(b, radius))
+
+
+def refine_mask(
+    mask: Image.Image, guide: Image.Image, radius: int = 4, eps: float = 1e-3, work_size: int = 1024
+) -> Image.Image:
+    """Upsample mask to guide's size so its edges follow the guide's edges.
+
+    Fast guided filter: the linear coefficients are fitted at work_size, then
+    upsampled and applied to the full-resolution luminance, so the cost stays
+    bounded however large the guide is.
+    """
+    luminance = guide.convert("L")
+    small = luminance.copy()
+    small.thumbnail((work_size, work_size), Image.Resampling.BILINEAR)
+    a, b = _guided_coefficients(mask, small, radius, eps)
+    refined = (
+        np.asarray(a.resize(guide.size, Image.Resampling.BILINEAR)) * (np.asarray(luminance, dtype=np.float32) / 255)
+        + np.asarray(b.resize(guide.size, Image.Resampling.BILINEAR))
+    )
+    return Image.fromarray((np.clip(refined, 0, 1) * 255).astype(np.uint8))
+
+
+def iter_cutout_png(
+    source: Union[bytes, str],
+    mask: Image.Image,
+    refine: bool = False,
+    strip_height: int = 256,
+    output: Optional[OutputOptions] = None,
+) -> Iterator[bytes]:
+    """Apply a low-resolution mask to a full-resolution image band by band and
+    yield the encoded PNG in chunks.
+
+    Only the decoded RGB image is held at full size; the upsampled mask,
+    RGBA pixels and encoder input never exist for more than strip_height
+    rows at a time. output must be PNG; with mask_only the upsampled mask
+    is written as a grayscale PNG instead of the cutout.
+    """
+    output = output or OutputOptions()
+    if output.format != "png":
+        raise ValueError("Streaming output is only available as PNG")
+    compress_level = output.compress_level
+    if compress_level is None:
+        compress_level = ENCODER_DEFAULTS["full"]["PNG"]["compress_level"]
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        with stage("decode"):
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.load()
+        width, height = img.size
+        scale = mask.height / height
+        if refine:
+            with stage("composite"):
+                guide_small = img.resize(mask.size, Image.Resampling.BILINEAR).convert("L")
+                a, b = _guided_coefficients(mask, guide_small, radius=4, eps=1e-3)
+        writer = StreamingPNGWriter(width, height, mode="L" if output.mask_only else "RGBA", compress_level=compress_level)
+        yield writer.header()
+        for top in range(0, height, strip_height):
+            bottom = min(top + strip_height, height)
+            size = (width, bottom - top)
+            # The region of the small mask that maps onto this band of rows
+            box = (0, top * scale, mask.width, bottom * scale)
+            with stage("composite"):
+                rgb = np.asarray(img.crop((0, top, width, bottom)), dtype=np.uint16)
+                if refine:
+                    luminance = np.asarray(Image.fromarray(rgb.astype(np.uint8)).convert("L"), dtype=np.float32) / 255
+                    alpha = (
+                        np.asarray(a.resize(size, Image.Resampling.BILINEAR, box=box)) * luminance
+                        + np.asarray(b.resize(size, Image.Resampling.BILINEAR, box=box))
+                    )
+                    alpha = (np.clip(alpha, 0, 1) * 255).astype(np.uint16)
+                else:
+                    alpha = np.asarray(mask.resize(size, Image.Resampling.BICUBIC, box=box), dtype=np.uint16)
+                if output.mask_only:
+                    rows = alpha.astype(np.uint8)[..., None]
+                else:
+                    rows = np.empty((bottom - top, width, 4), dtype=np.uint8)
+                    # Same premultiplied colours as rembg's naive_cutout
+                    rows[..., :3] = (rgb * alpha[..., None] + 127) // 255
+                    rows[..., 3] = alpha
+            with stage("encode"):
+                chunk = writer.write(rows)
+            if chunk:
+                yield chunk
+        with stage("encode"):
+            tail = writer.finish()
+        yield tail
+
+
 class BackgroundRemover:
-    def __init__(self, model_name: str = "u2net"):
+    def __init__(
+        self, model_name: str = "u2netp", intra_op_threads: Optional[int] = None, model_cache_dir: Optional[str] = None
+    ):
         self.model_name = model_name
+        self.intra_op_threads = intra_op_threads
+        # Where onnxruntime's optimized graphs are kept between starts; None disables it
+        self.model_cache_dir = model_cache_dir
         self.session = None
-        self._initialize_model()
+        self._session_lock = threading.Lock()
+
+    def _session_options(self) -> Optional["ort.SessionOptions"]:
+        if not self.intra_op_threads:
+            return None
+        import onnxruntime as ort
+
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = self.intra_op_threads
+        # Parallelism across requests comes from the executor, not from ONNX
+        sess_opts.inter_op_num_threads = 1
+        return sess_opts
+
+    def _cached_session(self) -> Any:
+        """Build the rembg session around a graph onnxruntime optimized on an earlier start.
+
+        The first start saves the graph after onnxruntime's portable
+        optimizations (ORT_ENABLE_EXTENDED: constant folding and fusions) into
+        model_cache_dir; later starts load it with the fusions already done,
+        which is most of the cost of creating a session. The layout
+        optimizations on top (ORT_ENABLE_ALL) depend on the host's CPU
+        features, so they are never saved and run at every load. Returns
+        None for models that cannot use the cache: rembg sessions with their
+        own constructor, and accelerator providers whose compiled graphs
+        cannot be saved.
+        """
+        import onnxruntime as ort
+        from rembg.sessions import sessions_class
+        from rembg.sessions.base import BaseSession
+
+        session_class = next((sc for sc in sessions_class if sc.name() == self.model_name), None)
+        if session_class is None or session_class.__init__ is not BaseSession.__init__:
+            return None
+        if ort.get_device() != "CPU" or "OpenVINOExecutionProvider" in ort.get_available_providers():
+            return None
+
+        model_path = str(session_class.download_models())
+        stat = os.stat(model_path)
+        # Optimized graphs are specific to the source model, the runtime version,
+        # the CPU architecture and the optimization level they were saved at
+        fingerprint = hashlib.sha256(
+            f"{model_path}|{stat.st_size}|{stat.st_mtime_ns}|{platform.machine()}|extended".encode()
+        ).hexdigest()[:16]
+        cache_path = os.path.join(self.model_cache_dir, f"{self.model_name}-ort{ort.__version__}-{fingerprint}.onnx")
+        providers = ["CPUExecutionProvider"]
+
+        inner_session = None
+        if os.path.exists(cache_path):
+            sess_opts = self._session_options() or ort.SessionOptions()
+            sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            try:
+                inner_session = ort.InferenceSession(cache_path, sess_options=sess_opts, providers=providers)
+                logger.info(f"Loaded optimized graph for {self.model_name} from {cache_path}")
+            except Exception as e:
+                logger.warning(f"Discarding optimized graph {cache_path}: {str(e)}")
+                os.remove(cache_path)
+        if inner_session is None:
+            os.makedirs(self.model_cache_dir, exist_ok=True)
+            # Process-mode workers may build the same graph at once; each writes
+            # its own file and the rename leaves one complete copy
+            build_path = f"{cache_path}.{os.getpid()}.tmp"
+            sess_opts = self._session_options() or ort.SessionOptions()
+            # ORT_ENABLE_ALL would save hardware-specific layouts (NCHWc) that
+            # are unsafe on a host with other CPU features sharing the cache
+            sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            sess_opts.optimized_model_filepath = build_path
+            ort.InferenceSession(model_path, sess_options=sess_opts, providers=providers)
+            os.replace(build_path, cache_path)
+            logger.info(f"Saved optimized graph for {self.model_name} to {cache_path}")
+            # Serve from the saved graph so this host's layout optimizations apply too
+            sess_opts = self._session_options() or ort.SessionOptions()
+            inner_session = ort.InferenceSession(cache_path, sess_options=sess_opts, providers=providers)
+
+        # Everything BaseSession.__init__ sets, without loading the source model again
+        session = session_class.__new__(session_class)
+        session.model_name = self.model_name
+        session.inner_session = inner_session
+        return session
 
     def _initialize_model(self):
-        try:
-            self.session = new_session(self.model_name)
-            logger.info(f"Loaded model: {self.model_name}")
-        except Exception as e:
-            logger.error(f"Model loading failed: {str(e)}")
-            raise RuntimeError(f"Could not load model {self.model_name}") from e
+        # Several executor threads may hit the first request at once
+        with self._session_lock:
+            if self.session:
+                return
+            try:
+                session = None
+                if self.model_cache_dir:
+                    try:
+                        session = self._cached_session()
+                    except Exception as e:
+                        logger.warning(f"Optimized graph cache unavailable for {self.model_name}: {str(e)}")
+                if session is None:
+                    from rembg import new_session
+
+                    session = new_session(self.model_name, sess_opts=self._session_options())
+                self.session = session
+                logger.info(f"Loaded model: {self.model_name}")
+            except Exception as e:
+                logger.error(f"Model loading failed: {str(e)}")
+                raise RuntimeError(f"Could not load model {self.model_name}") from e
 
     def process_image(self, input_data: bytes) -> bytes:
+        from rembg import remove
+
         if not self.session:
             self._initialize_model()
         return remove(input_data, session=self.session)
 
-    def process_and_save(self, input_path: str, output_path: Optional[str] = None) -> str:
-        if not output_path:
-            output_path = f"no_bg_{os.path.basename(input_path)}"
+    def decode(
+        self, source: ImageSource, max_size: Optional[Tuple[int, int]] = PREVIEW_SIZE, keep_alpha: bool = False
+    ) -> Image.Image:
+        """Decode bytes, a file path or a PIL image into an RGB image no larger
+        than max_size, or at full resolution when max_size is None. With
+        keep_alpha, images with transparency come back as RGBA instead."""
+        if isinstance(source, Image.Image):
+            mode = "RGBA" if keep_alpha and has_alpha(source) else "RGB"
+            img = source.convert(mode) if source.mode != mode else source.copy()
+        else:
+            with stage("decode"), Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+                if max_size:
+                    # Let the JPEG decoder downscale by 1/2..1/8 instead of decoding full size
+                    img.draft("RGB", max_size)
+                mode = "RGBA" if keep_alpha and has_alpha(img) else "RGB"
+                if img.mode != mode:
+                    img = img.convert(mode)
+                img.load()
+        if max_size:
+            with stage("resize"):
+                img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        return img
 
-        # Resize image before processing
-        with Image.open(input_path) as img:
-            # Convert to RGB if needed (rembg requires RGB)
-            if img.mode != "RGB":
-                img = img.convert("RGB")
-            # Resize to max 500px while preserving aspect ratio
-            img.thumbnail((500, 500), Image.Resampling.LANCZOS)
-            # Save to bytes for rembg
-            buffer = io.BytesIO()
-            img.save(buffer, format="PNG")
-            input_data = buffer.getvalue()
+    @staticmethod
+    def _normalize(img: Image.Image, mean, std, size) -> np.ndarray:
+        im_ary = np.asarray(img.resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+        im_ary = im_ary / max(float(im_ary.max()), 1e-6)
+        im_ary = (im_ary - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+        return im_ary.transpose((2, 0, 1))
+
+    def predict_masks(
+        self, images: List[Image.Image], sizes: Optional[List[Tuple[int, int]]] = None
+    ) -> List[Image.Image]:
+        """Predict alpha masks for several images with a single forward pass.
+
+        Masks are resized to each image's size, or to the matching entry of
+        sizes, which lets a mask computed on a small copy go straight to full
+        resolution without an intermediate resize.
+        """
+        if not self.session:
+            self._initialize_model()
+        sizes = sizes or [img.size for img in images]
+        spec = BATCH_INPUT_SPECS.get(self.model_name)
+        if spec is None:
+            with stage("inference"):
+                masks = [self.session.predict(img)[0] for img in images]
+            with stage("resize"):
+                return [mask.resize(size, Image.Resampling.LANCZOS) for mask, size in zip(masks, sizes)]
+        mean, std, size = spec
+        with stage("resize"):
+            batch = np.stack([self._normalize(img, mean, std, size) for img in images])
+        inner_session = self.session.inner_session
+        model_input = inner_session.get_inputs()[0]
+        with stage("inference"):
+            if isinstance(model_input.shape[0], int):
+                # Graph was exported with a fixed batch size, feed it one slice at a time
+                preds = np.concatenate([
+                    inner_session.run(None, {model_input.name: batch[i:i + 1]})[0]
+                    for i in range(len(images))
+                ])
+            else:
+                preds = inner_session.run(None, {model_input.name: batch})[0]
+        masks = []
+        with stage("resize"):
+            for pred, size in zip(preds[:, 0, :, :], sizes):
+                pred = (pred - pred.min()) / max(float(pred.max() - pred.min()), 1e-6)
+                mask = Image.fromarray((pred * 255).astype(np.uint8))
+                masks.append(mask.resize(size, Image.Resampling.LANCZOS))
+        return masks
+
+    def _encode_result(self, img: Image.Image, mask: Image.Image, output: Optional[OutputOptions], full: bool = False) -> bytes:
+        output = output or OutputOptions()
+        return encode_image(mask if output.mask_only else apply_mask(img, mask), output, full)
 
-        # Process with rembg
-        result = self.process_image(input_data)
+    def process_bytes(self, source: ImageSource, output: Optional[OutputOptions] = None) -> bytes:
+        """Decode, cut out and encode one image entirely in memory."""
+        img = self.decode(source)
+        return self._encode_result(img, self.predict_masks([img])[0], output)
 
-        # Save the result
-        with open(output_path, "wb") as f:
-            f.write(result)
+    def process_preview(self, source: ImageSource, output: Optional[OutputOptions] = None) -> Tuple[bytes, Image.Image]:
+        """Return the encoded preview cutout together with its mask, which
+        process_full() can reuse instead of running the model again."""
+        img = self.decode(source)
+        mask = self.predict_masks([img])[0]
+        return self._encode_result(img, mask, output), mask
 
-        return output_path
+    def predict_mask(self, source: ImageSource) -> Image.Image:
+        """Preview-sized mask for source, for callers that apply it themselves."""
+        return self.predict_masks([self.decode(source)])[0]
 
-    def validate_image(self, file_path: str, max_size_mb: int = 5) -> bool:
-        if not os.path.exists(file_path):
-            raise ValueError("File does not exist")
+    def process_full(
+        self,
+        source: ImageSource,
+        mask: Optional[Image.Image] = None,
+        refine: bool = False,
+        output: Optional[OutputOptions] = None,
+    ) -> bytes:
+        """Cut out the image at its original resolution.
 
-        if os.path.getsize(file_path) > max_size_mb * 1024 * 1024:
-            raise ValueError(f"File exceeds {max_size_mb}MB limit")
+        The model only ever sees a preview-sized copy; its mask is upsampled
+        to full size (edge-aware when refine is set) and applied to the
+        original pixels.
+        """
+        return self._cut_out_full(self.decode(source, max_size=None), mask, refine, output)
+
+    def _cut_out_full(
+        self, img: Image.Image, mask: Optional[Image.Image], refine: bool, output: Optional[OutputOptions]
+    ) -> bytes:
+        if mask is None:
+            with stage("resize"):
+                small = img.copy()
+                small.thumbnail(PREVIEW_SIZE, Image.Resampling.BILINEAR)
+            target_size = small.size if refine else img.size
+            mask = self.predict_masks([small], sizes=[target_size])[0]
+        with stage("resize"):
+            if refine:
+                mask = refine_mask(mask, img)
+            elif mask.size != img.size:
+                mask = mask.resize(img.size, Image.Resampling.BICUBIC)
+        return self._encode_result(img, mask, output, full=True)
+
+    def process_with_original(
+        self, source: ImageSource, resolution: str = "preview", refine: bool = False, output: Optional[OutputOptions] = None
+    ) -> Tuple[bytes, Tuple[bytes, str]]:
+        """Cut out source at resolution ("preview" or "full") and return it
+        together with encode_original_preview()'s copy of the original, both
+        from a single decode."""
+        img = self.decode(source, max_size=None if resolution == "full" else PREVIEW_SIZE, keep_alpha=True)
+        original = encode_original_preview(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if resolution == "full":
+            return self._cut_out_full(img, None, refine, output), original
+        return self._encode_result(img, self.predict_masks([img])[0], output), original
+
+    def process_batch(self, sources: List[ImageSource], output: Optional[OutputOptions] = None) -> List[Union[bytes, Exception]]:
+        """Cut out several images in one batched inference call.
+
+        Returns one entry per input: the encoded result, or the exception that
+        stopped that image, so a bad file does not fail the whole batch.
+        """
+        results: List[Union[bytes, Exception, None]] = [None] * len(sources)
+        images = []
+        decoded = []
+        for index, source in enumerate(sources):
+            try:
+                images.append(self.decode(source))
+                decoded.append(index)
+            except Exception as e:
+                logger.error(f"Decoding failed for batch item {index}: {str(e)}")
+                results[index] = e
+        if images:
+            masks = self.predict_masks(images)
+            for index, img, mask in zip(decoded, images, masks):
+                results[index] = self._encode_result(img, mask, output)
+        return results
+
+    def process_and_save(self, input_path: str, output_path: Optional[str] = None) -> str:
+        try:
+            if not output_path:
+                output_path = f"result_{uuid.uuid4()}.png"
+            result = self.process_bytes(input_path)
+            with open(output_path, "wb") as f:
+                f.write(result)
+            return output_path
+        except Exception as e:
+            logger.error(f"Processing failed for {input_path}: {str(e)}")
+            raise
 
+    def validate_image(self, file_path: str, memory_budget: Optional[MemoryBudget] = None) -> bool:
         try:
+            if not os.path.exists(file_path):
+                raise ValueError("File does not exist")
             with Image.open(file_path) as img:
+                if memory_budget:
+                    memory_budget.check(*img.size)
                 img.verify()
             return True
         except Exception as e:
-            raise ValueError(f"Invalid image file: {str(e)}")
\ No newline at end of file
+            logger.error(f"Validation failed for {file_path}: {str(e)}")
+            raise
@@ -0,0 +1,225 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+
+from src.services import metrics
+from src.services.session_registry import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+# Default worker count is cpu_count // this, capped at MAX_DEFAULT_WORKERS, so
+# each session keeps at least this many intra-op threads on larger machines
+MIN_DEFAULT_INTRA_OP_THREADS = 4
+MAX_DEFAULT_WORKERS = 4
+
+# Sessions owned by this worker process (process mode only)
+_worker_registry: Optional[SessionRegistry] = None
+
+
+def _init_worker(model_names: List[str], intra_op_threads: int, model_cache_dir: Optional[str]):
+    global _worker_registry
+    _worker_registry = SessionRegistry(model_names, intra_op_threads=intra_op_threads, model_cache_dir=model_cache_dir)
+    _worker_registry.warm_up()
+    logger.info(f"Inference worker {os.getpid()} ready for models {', '.join(model_names)}")
+
+
+def _call_worker(model: str, method: str, *args: Any) -> Tuple[Any, Dict[str, float]]:
+    return metrics.timed_call(getattr(_worker_registry.get(model), method), *args)
+
+
+def _worker_states() -> Tuple[Dict[str, str], Dict[str, float]]:
+    return dict(_worker_registry.states), dict(_worker_registry.load_seconds)
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """Runs BackgroundRemover calls off the event loop with a bounded backlog.
+
+    In "thread" mode all workers share the registry's removers (ONNX sessions'
+    run() is thread-safe); in "process" mode every worker process builds and
+    warms up its own registry. Either way each session gets cpu_count // workers intra-op threads
+    so the pool as a whole uses every core without oversubscribing them.
+
+    The default is a few workers with several intra-op threads each: a lone
+    request (the panel's usual load) still spreads over several cores, while
+    concurrent requests run side by side.
+    """
+
+    def __init__(
+        self,
+        registry: SessionRegistry,
+        mode: str = "thread",
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        intra_op_threads: Optional[int] = None,
+    ):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown executor mode: {mode}")
+        cpu_count = os.cpu_count() or 1
+        self.mode = mode
+        self.registry = registry
+        self.workers = workers or max(1, min(MAX_DEFAULT_WORKERS, cpu_count // MIN_DEFAULT_INTRA_OP_THREADS))
+        self.max_pending = max_pending or self.workers * 4
+        self.intra_op_threads = intra_op_threads or max(1, cpu_count // self.workers)
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._avg_task_seconds = 1.0
+
+    @classmethod
+    def from_env(cls, registry: SessionRegistry) -> "InferenceExecutor":
+        def env_int(name: str) -> Optional[int]:
+            value = os.environ.get(name)
+            return int(value) if value else None
+
+        return cls(
+            registry,
+            mode=os.environ.get("INFERENCE_EXECUTOR", "thread"),
+            workers=env_int("INFERENCE_WORKERS"),
+            max_pending=env_int("INFERENCE_QUEUE_SIZE"),
+            intra_op_threads=env_int("ONNX_INTRA_OP_THREADS"),
+        )
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        if self._executor:
+            return
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Forking a process that already runs uvicorn and ONNX threads is unsafe
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.registry.model_names, self.intra_op_threads, self.registry.model_cache_dir),
+            )
+        else:
+            self.registry.set_intra_op_threads(self.intra_op_threads)
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        logger.info(
+            f"Started {self.mode} inference pool: {self.workers} workers, "
+            f"{self.intra_op_threads} intra-op threads each, queue size {self.max_pending}"
+        )
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def retry_after(self) -> int:
+        # Time for the current backlog to drain through all workers
+        return max(1, math.ceil(self._pending * self._avg_task_seconds / self.workers))
+
+    @property
+    def idle_workers(self) -> int:
+        return max(0, self.workers - self._pending)
+
+    @property
+    def free_slots(self) -> int:
+        return max(0, self.max_pending - self._pending)
+
+    def has_capacity(self, count: int = 1) -> bool:
+        return self._pending + count <= self.max_pending
+
+    def _reserve(self, count: int):
+        with self._lock:
+            if self._pending + count > self.max_pending:
+                raise QueueFullError(self.retry_after())
+            self._pending += count
+
+    def _release(self, elapsed: float):
+        with self._lock:
+            self._pending -= 1
+            self._avg_task_seconds = 0.8 * self._avg_task_seconds + 0.2 * elapsed
+
+    def _submit(
+        self, model: Optional[str], method: str, args: Tuple[Any, ...], on_done: Optional[Callable[[], None]]
+    ) -> "asyncio.Future[Tuple[Any, Dict[str, float]]]":
+        if not self._executor:
+            self.start()
+        model = model or self.registry.default_model
+        if self.mode == "process":
+            future = self._executor.submit(_call_worker, model, method, *args)
+        else:
+            future = self._executor.submit(metrics.timed_call, getattr(self.registry.get(model), method), *args)
+        start_time = time.time()
+
+        def finished(_):
+            self._release(time.time() - start_time)
+            if on_done:
+                on_done()
+
+        # The concurrent future only completes once the worker is done with the
+        # call; an asyncio future from run_in_executor is cancelled along with
+        # the awaiting task while the worker keeps running
+        future.add_done_callback(finished)
+        return asyncio.wrap_future(future)
+
+    async def run_with_timings(
+        self, method: str, *args: Any, model: Optional[str] = None, on_done: Optional[Callable[[], None]] = None
+    ) -> Tuple[Any, Dict[str, float]]:
+        """Like run(), but hands back the call's stage timings instead of adding
+        them to the current request, for callers serving several requests at once."""
+        try:
+            self._reserve(1)
+        except QueueFullError:
+            if on_done:
+                on_done()
+            raise
+        start_time = time.perf_counter()
+        result, timings = await self._submit(model, method, args, on_done)
+        # Whatever the stages do not account for was spent waiting for a worker
+        timings["queue"] = max(0.0, time.perf_counter() - start_time - sum(timings.values()))
+        metrics.observe_stages(timings)
+        return result, timings
+
+    async def run(
+        self, method: str, *args: Any, model: Optional[str] = None, on_done: Optional[Callable[[], None]] = None
+    ) -> Any:
+        """Run <model remover>.<method>(*args) in the pool; raises QueueFullError when saturated.
+
+        on_done is called once the worker has finished with the call, even if
+        the awaiting task was cancelled first, or straight away if the call is
+        rejected; callers use it to release resources the worker still needs.
+        """
+        result, timings = await self.run_with_timings(method, *args, model=model, on_done=on_done)
+        metrics.add_request_timings(timings)
+        return result
+
+    async def warm_up(self):
+        """Load and warm every configured model in the workers that will serve it.
+
+        Runs outside the bounded queue; the registry's states are updated as
+        workers report back so /health can tell when the instance is ready.
+        """
+        if not self._executor:
+            self.start()
+        loop = asyncio.get_running_loop()
+        if self.mode == "process":
+            # Workers warm up in their initializer; one probe per worker waits for them
+            probes = [loop.run_in_executor(self._executor, _worker_states) for _ in range(self.workers)]
+            for name in self.registry.model_names:
+                self.registry.states[name] = "loading"
+            results = await asyncio.gather(*probes, return_exceptions=True)
+            for name in self.registry.model_names:
+                ok = all(isinstance(r, tuple) and r[0].get(name) == "ready" for r in results)
+                self.registry.states[name] = "ready" if ok else "failed"
+                if ok:
+                    self.registry.load_seconds[name] = max(r[1][name] for r in results)
+        else:
+            # Collect the warm-up's stage timings so the dummy image stays out of the histograms
+            await loop.run_in_executor(self._executor, metrics.timed_call, self.registry.warm_up)
+        logger.info(f"Model warm-up finished: {self.registry.states}")
@@ -0,0 +1,275 @@
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import io
+import logging
+import os
+import shutil
+import time
+import uuid
+import zipfile
+
+from src.services.inference_pool import InferenceExecutor, QueueFullError
+from src.services.job_store import JobStore, SQLiteJobStore
+from src.services.memory_budget import MemoryBudget, image_info
+
+logger = logging.getLogger(__name__)
+
+# How often finished jobs past their retention are looked for
+SWEEP_INTERVAL_SECONDS = 600
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink that ZipFile streams into."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def result_filename(filename: str, extension: str = "png") -> str:
+    return f"no_bg_{os.path.splitext(os.path.basename(filename))[0]}.{extension}"
+
+
+class JobManager:
+    """Runs batch jobs in the background so large batches outlive any one request.
+
+    Uploads are written to data_dir/<job_id>/ and the job is recorded in the
+    store before it is queued, so a restart picks unfinished jobs back up.
+    Items are cut out batch_size at a time through the shared inference
+    executor, with at most `concurrency` batches in flight so interactive
+    requests still get executor slots. A full executor queue is waited out
+    rather than failing the job. Finished jobs are deleted, uploads and
+    results included, retention_seconds after their last update (0 keeps
+    them until DELETE /jobs/{id}).
+
+    Every job is owned by the process that runs it. When several processes
+    share the store, only one of them should resume all unfinished jobs at
+    start-up; a process replacing one that died sets takeover_from to the dead
+    process's pid to pick up just its jobs.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        executor: InferenceExecutor,
+        data_dir: str,
+        batch_size: int = 8,
+        concurrency: Optional[int] = None,
+        memory_budget: Optional[MemoryBudget] = None,
+        resume: bool = True,
+        retention_seconds: float = 24 * 3600,
+    ):
+        self.store = store
+        self.executor = executor
+        self.data_dir = data_dir
+        self.batch_size = batch_size
+        self.concurrency = concurrency or max(1, executor.workers // 2)
+        self.memory_budget = memory_budget
+        self.resume = resume
+        self.takeover_from: Optional[int] = None
+        self.retention_seconds = retention_seconds
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._events: Dict[str, asyncio.Event] = {}
+        self._worker: Optional["asyncio.Task[None]"] = None
+        self._sweeper: Optional["asyncio.Task[None]"] = None
+        os.makedirs(data_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, executor: InferenceExecutor, memory_budget: Optional[MemoryBudget] = None) -> "JobManager":
+        data_dir = os.environ.get("JOB_DIR", "jobs")
+        concurrency = os.environ.get("JOB_CONCURRENCY")
+        return cls(
+            SQLiteJobStore(os.path.join(data_dir, "jobs.sqlite3")),
+            executor,
+            data_dir,
+            batch_size=int(os.environ.get("JOB_BATCH_SIZE", 8)),
+            concurrency=int(concurrency) if concurrency else None,
+            memory_budget=memory_budget,
+            retention_seconds=float(os.environ.get("JOB_RETENTION_HOURS", 24)) * 3600,
+        )
+
+    async def start(self):
+        if self.resume:
+            for job_id in await asyncio.to_thread(self.store.unfinished_jobs, os.getpid()):
+                self._queue.put_nowait(job_id)
+        elif self.takeover_from is not None:
+            for job_id in await asyncio.to_thread(self.store.unfinished_jobs, os.getpid(), self.takeover_from):
+                self._queue.put_nowait(job_id)
+        if not self._queue.empty():
+            logger.info(f"Resuming {self._queue.qsize()} unfinished jobs")
+        self._worker = asyncio.create_task(self._run())
+        if self.retention_seconds > 0:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        for task in (self._worker, self._sweeper):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._worker = self._sweeper = None
+
+    def create(self, model: str, files: List[Tuple[str, BinaryIO]]) -> str:
+        """Copy the uploads into the job directory and record a queued job;
+        call enqueue() afterwards. Files are copied in chunks, never read whole."""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.data_dir, job_id)
+        os.makedirs(job_dir)
+        items = []
+        for index, (filename, source) in enumerate(files):
+            input_path = os.path.join(job_dir, f"{index}.input")
+            with open(input_path, "wb") as f:
+                shutil.copyfileobj(source, f)
+            try:
+                if self.memory_budget:
+                    width, height, image_format = image_info(input_path)
+                    self.memory_budget.check(width, height, "decode", image_format)
+            except Exception as e:
+                os.remove(input_path)
+                items.append({"filename": filename, "status": "error", "error": str(e)})
+                continue
+            items.append({"filename": filename, "input_path": input_path})
+        self.store.create_job(job_id, model, items, owner=os.getpid())
+        return job_id
+
+    def enqueue(self, job_id: str):
+        self._queue.put_nowait(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        deleted = self.store.delete_job(job_id)
+        shutil.rmtree(os.path.join(self.data_dir, job_id), ignore_errors=True)
+        return deleted
+
+    def delete_expired(self) -> int:
+        """Delete finished jobs past their retention; returns how many."""
+        expired = self.store.expired_jobs(time.time() - self.retention_seconds)
+        for job_id in expired:
+            self.delete(job_id)
+        return len(expired)
+
+    async def _sweep(self):
+        while True:
+            try:
+                deleted = await asyncio.to_thread(self.delete_expired)
+                if deleted:
+                    logger.info(f"Deleted {deleted} jobs older than {self.retention_seconds / 3600:g} hours")
+            except Exception as e:
+                logger.error(f"Job retention sweep failed: {str(e)}")
+            await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+
+    def _notify(self, job_id: str):
+        event = self._events.pop(job_id, None)
+        if event:
+            event.set()
+
+    async def wait_for_update(self, job_id: str, timeout: float) -> bool:
+        """Wait until the job changes; returns False if nothing happened within timeout."""
+        event = self._events.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process_job(job_id)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+            finally:
+                self._notify(job_id)
+
+    async def _process_job(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        if job is None:
+            return
+        await asyncio.to_thread(self.store.set_job_status, job_id, "running")
+        self._notify(job_id)
+        items = await asyncio.to_thread(self.store.get_items, job_id)
+        queued = [item for item in items if item["status"] == "queued"]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_chunk(chunk: List[Dict[str, Any]]):
+            async with semaphore:
+                await self._process_chunk(job_id, job["model"], chunk)
+
+        await asyncio.gather(*(
+            run_chunk(queued[start:start + self.batch_size])
+            for start in range(0, len(queued), self.batch_size)
+        ))
+        if await asyncio.to_thread(self.store.get_job, job_id) is not None:
+            await asyncio.to_thread(self.store.set_job_status, job_id, "done")
+            logger.info(f"Job {job_id} finished: {len(queued)} items processed")
+
+    async def _process_chunk(self, job_id: str, model: str, chunk: List[Dict[str, Any]]):
+        # The job may have been deleted while this chunk was waiting its turn
+        if await asyncio.to_thread(self.store.get_job, job_id) is None:
+            return
+        for item in chunk:
+            await asyncio.to_thread(self.store.update_item, job_id, item["idx"], "processing")
+        self._notify(job_id)
+        outcomes = await self._run_batch(model, [item["input_path"] for item in chunk])
+        await asyncio.to_thread(self._store_outcomes, job_id, chunk, outcomes)
+        self._notify(job_id)
+
+    async def _run_batch(self, model: str, paths: List[str]) -> List[Any]:
+        while True:
+            try:
+                return await self.executor.run("process_batch", paths, model=model)
+            except QueueFullError as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                return [e] * len(paths)
+
+    def _store_outcomes(self, job_id: str, chunk: List[Dict[str, Any]], outcomes: List[Any]):
+        if not os.path.isdir(os.path.join(self.data_dir, job_id)):
+            return
+        for item, outcome in zip(chunk, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Job {job_id} item {item['filename']} failed: {str(outcome)}")
+                self.store.update_item(job_id, item["idx"], "error", error=str(outcome))
+                continue
+            result_path = os.path.join(self.data_dir, job_id, f"{item['idx']}.png")
+            with open(result_path, "wb") as f:
+                f.write(outcome)
+            self.store.update_item(job_id, item["idx"], "done", result_path=result_path)
+            os.remove(item["input_path"])
+
+    def iter_zip(self, job_id: str, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        """Stream every finished result of a job as a ZIP archive, one file at a time."""
+        buffer = ChunkBuffer()
+        names = set()
+        # PNGs are already deflated, so store them as-is
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+            for item in self.store.get_items(job_id):
+                if item["status"] != "done":
+                    continue
+                name = result_filename(item["filename"])
+                if name in names:
+                    name = f"{item['idx']}_{name}"
+                names.add(name)
+                with open(item["result_path"], "rb") as source, archive.open(name, "w") as target:
+                    while True:
+                        data = source.read(chunk_size)
+                        if not data:
+                            break
+                        target.write(data)
+                        yield buffer.drain()
+                yield buffer.drain()
+        # Central directory, written when the archive is closed
+        yield buffer.drain()
@@ -0,0 +1,185 @@
+from typing import Any, Dict, List, Optional
+import os
+import sqlite3
+import threading
+import time
+
+# Item states: queued -> processing -> done | error
+# Job states: queued -> running -> done
+ITEM_STATES = ("queued", "processing", "done", "error")
+
+
+class JobStore:
+    """Persistence interface for batch jobs.
+
+    JobManager only talks to this interface, so a different backend (e.g. a
+    shared database for several instances) can be dropped in without touching
+    the queueing logic. Implementations must be safe to call from any thread.
+    """
+
+    def create_job(self, job_id: str, model: str, items: List[Dict[str, Any]], owner: Optional[int] = None):
+        """Store a new queued job run by process `owner`; items carry filename,
+        input_path and optionally status/error."""
+        raise NotImplementedError
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job with per-state item counts, or None if it does not exist."""
+        raise NotImplementedError
+
+    def get_items(self, job_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_item(self, job_id: str, index: int) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set_job_status(self, job_id: str, status: str):
+        raise NotImplementedError
+
+    def update_item(self, job_id: str, index: int, status: str, result_path: Optional[str] = None, error: Optional[str] = None):
+        raise NotImplementedError
+
+    def unfinished_jobs(self, owner: Optional[int] = None, previous_owner: Optional[int] = None) -> List[str]:
+        """Jobs that were queued or running, oldest first, after resetting their
+        interrupted items to queued and handing them to owner. With
+        previous_owner, only that (dead) process's jobs are taken over."""
+        raise NotImplementedError
+
+    def expired_jobs(self, before: float) -> List[str]:
+        """Finished jobs last updated before the given timestamp."""
+        raise NotImplementedError
+
+    def delete_job(self, job_id: str) -> bool:
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """Default JobStore backed by a single SQLite file.
+
+    Each process opens its own connection on first use, so preforked workers
+    never share one inherited across fork().
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    owner INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,
+                    idx INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    input_path TEXT,
+                    result_path TEXT,
+                    error TEXT,
+                    PRIMARY KEY (job_id, idx)
+                );
+                """
+            )
+            # Stores created before jobs had an owner
+            columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.row_factory = sqlite3.Row
+            self._pid = os.getpid()
+        return self._connection
+
+    def create_job(self, job_id: str, model: str, items: List[Dict[str, Any]], owner: Optional[int] = None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO jobs (id, model, status, created, updated, owner) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, model, now, now, owner),
+            )
+            self._conn.executemany(
+                "INSERT INTO job_items (job_id, idx, filename, status, input_path, error) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, index, item["filename"], item.get("status", "queued"), item.get("input_path"), item.get("error"))
+                    for index, item in enumerate(items)
+                ],
+            )
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        job = dict(row)
+        job.update({state: counts.get(state, 0) for state in ITEM_STATES})
+        job["total"] = sum(counts.values())
+        return job
+
+    def get_items(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_item(self, job_id: str, index: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM job_items WHERE job_id = ? AND idx = ?", (job_id, index)).fetchone()
+        return dict(row) if row else None
+
+    def set_job_status(self, job_id: str, status: str):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, updated = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def update_item(self, job_id: str, index: int, status: str, result_path: Optional[str] = None, error: Optional[str] = None):
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE job_items SET status = ?, result_path = ?, error = ? WHERE job_id = ? AND idx = ?",
+                (status, result_path, error, job_id, index),
+            )
+            self._conn.execute("UPDATE jobs SET updated = ? WHERE id = ?", (time.time(), job_id))
+
+    def unfinished_jobs(self, owner: Optional[int] = None, previous_owner: Optional[int] = None) -> List[str]:
+        query = "SELECT id FROM jobs WHERE status IN ('queued', 'running')"
+        params: List[Any] = []
+        if previous_owner is not None:
+            query += " AND owner = ?"
+            params.append(previous_owner)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            job_ids = [row["id"] for row in self._conn.execute(query + " ORDER BY created", params).fetchall()]
+            for job_id in job_ids:
+                self._conn.execute(
+                    "UPDATE job_items SET status = 'queued' WHERE job_id = ? AND status = 'processing'", (job_id,)
+                )
+                self._conn.execute("UPDATE jobs SET owner = ? WHERE id = ?", (owner, job_id))
+        return job_ids
+
+    def expired_jobs(self, before: float) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status = 'done' AND updated < ? ORDER BY updated", (before,)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def delete_job(self, job_id: str) -> bool:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            deleted = self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+        return deleted > 0
@@ -0,0 +1,130 @@
+from typing import Callable, Optional, Tuple, Union
+from PIL import Image
+import io
+import os
+import threading
+
+from src.services.metrics import stage
+
+
+# MEMORY_BUDGET_MB when unset (per process)
+DEFAULT_BUDGET_MB = 1024
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+def image_info(source: Union[bytes, str, Image.Image]) -> Tuple[int, int, Optional[str]]:
+    """Read width, height and format from the image header without decoding pixels."""
+    if isinstance(source, Image.Image):
+        return source.width, source.height, source.format
+    with stage("validate"), Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        return img.width, img.height, img.format
+
+
+def image_dimensions(source: Union[bytes, str, Image.Image]) -> Tuple[int, int]:
+    """Read width and height from the image header without decoding pixels."""
+    width, height, _ = image_info(source)
+    return width, height
+
+
+class MemoryBudget:
+    """Limits how much decoded pixel data in-flight requests may hold.
+
+    Replaces the old fixed 5MB file-size cap: a small, well-compressed file
+    can decode to hundreds of megabytes, while a large JPEG may be perfectly
+    manageable. An image is rejected outright if it could never fit, and
+    work waits its turn (429) when the budget is in use.
+
+    What an image costs depends on how it is processed, so every estimate
+    names the path it is for.
+    """
+
+    # Peak bytes per pixel of each path, measured on 24-megapixel inputs
+    COST_PER_PIXEL = {
+        # Buffered full resolution: the RGB decode, the full-size mask (and
+        # guided filter), rembg's naive_cutout with its blank RGBA canvas, the
+        # RGBA result and its encoding
+        "full": 24,
+        # "full" plus the base64 copy and JSON body /process returns it in
+        "process": 32,
+        # Streamed full resolution: only the decode (and its conversion to RGB)
+        # is held whole; masks, composite and encoder work one band at a time
+        "tiled": 12,
+        # Preview and batch paths: the decode before it is shrunk for the model
+        "decode": 8,
+        # One frame of a sequence in flight: RGB frame, full-size mask and cutout
+        "frame": 8,
+    }
+    # Size JPEGs are reduced towards while decoding (PREVIEW_SIZE)
+    DRAFT_SIZE = (500, 500)
+
+    def __init__(self, total_bytes: int):
+        self.total_bytes = total_bytes
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "MemoryBudget":
+        return cls(int(os.environ.get("MEMORY_BUDGET_MB", DEFAULT_BUDGET_MB)) * 1024 * 1024)
+
+    def estimate(self, width: int, height: int, path: str = "full", format: Optional[str] = None) -> int:
+        pixels = width * height
+        if path == "decode" and format == "JPEG":
+            # The JPEG decoder scales by 1/2, 1/4 or 1/8 while staying above DRAFT_SIZE
+            reduction = max(1, min(width // self.DRAFT_SIZE[0], height // self.DRAFT_SIZE[1]))
+            scale = next(scale for scale in (8, 4, 2, 1) if reduction >= scale)
+            pixels = -(-width // scale) * -(-height // scale)
+        return pixels * self.COST_PER_PIXEL[path]
+
+    def check(self, width: int, height: int, path: str = "full", format: Optional[str] = None) -> int:
+        """Return the estimated cost of processing an image along path, raising
+        if it exceeds the whole budget."""
+        needed = self.estimate(width, height, path, format)
+        if needed > self.total_bytes:
+            raise ImageTooLargeError(
+                f"Image of {width}x{height} needs about {needed // (1024 * 1024)}MB, "
+                f"over the {self.total_bytes // (1024 * 1024)}MB memory budget"
+            )
+        return needed
+
+    def try_acquire(self, nbytes: int) -> bool:
+        with self._lock:
+            if self.in_use + nbytes > self.total_bytes:
+                return False
+            self.in_use += nbytes
+            return True
+
+    def release(self, nbytes: int):
+        with self._lock:
+            self.in_use -= nbytes
+
+
+class Reservation:
+    """nbytes of a MemoryBudget, returned once every holder has released them.
+
+    The request that reserved the memory is the first holder; each worker
+    call it hands the memory to takes another with hold(), so a request
+    cancelled by a client disconnect cannot free memory a worker is still
+    decoding into.
+    """
+
+    def __init__(self, budget: MemoryBudget, nbytes: int):
+        self.budget = budget
+        self.nbytes = nbytes
+        self._holders = 1
+        self._lock = threading.Lock()
+
+    def hold(self) -> Callable[[], None]:
+        """Add a holder; returns the callable that releases it."""
+        with self._lock:
+            self._holders += 1
+        return self.release
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            last = self._holders == 0
+        if last:
+            self.budget.release(self.nbytes)
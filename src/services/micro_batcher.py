@@ -0,0 +1,165 @@
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, TypeVar, Union
+import asyncio
+import logging
+import math
+import os
+
+from src.services import metrics
+from src.services.background_remover import ImageSource, OutputOptions
+from src.services.inference_pool import InferenceExecutor, QueueFullError
+from src.services.memory_budget import Reservation
+
+logger = logging.getLogger(__name__)
+
+# Requests can only share a batch if they use the same model and output options
+BatchKey = Tuple[str, OutputOptions]
+BatchItem = Tuple[ImageSource, "asyncio.Future[Tuple[bytes, Dict[str, float]]]", Optional[Reservation]]
+
+T = TypeVar("T")
+
+
+def split_evenly(items: Sequence[T], parts: int) -> List[List[T]]:
+    """Split items into `parts` consecutive chunks whose sizes differ by at most one."""
+    size, extra = divmod(len(items), parts)
+    chunks, start = [], 0
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        chunks.append(list(items[start:end]))
+        start = end
+    return [chunk for chunk in chunks if chunk]
+
+
+def hold_all(reservations: Sequence[Optional[Reservation]]) -> Optional[Callable[[], None]]:
+    """Hold every reservation for one executor call; returns its on_done."""
+    releases = [reservation.hold() for reservation in reservations if reservation]
+    if not releases:
+        return None
+
+    def release_all():
+        for release in releases:
+            release()
+
+    return release_all
+
+
+class MicroBatcher:
+    """Coalesces single-image requests that arrive close together into one batch.
+
+    A batch runs on a single executor slot, so batching only pays off once
+    every worker is busy: until then each request goes straight to an idle
+    worker. Once the pool is saturated, the first request opens a window of
+    max_delay_ms; everything that arrives before it closes (or until
+    max_batch_size is reached) shares batched forward passes, split across
+    whichever workers have freed up by then. Requests for different models
+    or output options are batched separately.
+    """
+
+    def __init__(self, executor: InferenceExecutor, max_batch_size: int = 1, max_delay_ms: float = 5.0):
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._items: Dict[BatchKey, List[BatchItem]] = {}
+        self._flush_handles: Dict[BatchKey, asyncio.TimerHandle] = {}
+        self._batches: Set["asyncio.Task[None]"] = set()
+
+    @classmethod
+    def from_env(cls, executor: InferenceExecutor) -> "MicroBatcher":
+        return cls(
+            executor,
+            # Off by default: enable it where benchmarks.batching shows a gain
+            max_batch_size=int(os.environ.get("MICRO_BATCH_MAX_SIZE", 1)),
+            max_delay_ms=float(os.environ.get("MICRO_BATCH_DELAY_MS", 5)),
+        )
+
+    async def process(
+        self, source: ImageSource, model: str, output: Optional[OutputOptions] = None, reservation: Optional[Reservation] = None
+    ) -> bytes:
+        """Cut out one image, sharing a forward pass with concurrent callers.
+
+        reservation, if given, is held until the worker that decodes source is done.
+        """
+        output = output or OutputOptions()
+        key = (model, output)
+        if self.max_batch_size <= 1 or (key not in self._items and self.executor.idle_workers > 0):
+            return await self.executor.run("process_bytes", source, output, model=model, on_done=hold_all([reservation]))
+        # Refuse early rather than queueing behind a batch that cannot be admitted;
+        # checked before _items is touched so a refusal leaves no empty window behind
+        if key not in self._items and not self.executor.has_capacity():
+            raise QueueFullError(self.executor.retry_after())
+        items = self._items.setdefault(key, [])
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        items.append((source, future, reservation))
+        if len(items) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._flush_handles:
+            self._flush_handles[key] = loop.call_later(self.max_delay, self._flush, key)
+        result, timings = await future
+        # Every request in the batch waited for the whole batch, so each reports its stages
+        metrics.add_request_timings(timings)
+        return result
+
+    def _flush(self, key: BatchKey):
+        handle = self._flush_handles.pop(key, None)
+        if handle:
+            handle.cancel()
+        items = self._items.pop(key, [])
+        if items:
+            task = asyncio.ensure_future(self._run_batch(key, items))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    def parts_for(self, count: int) -> int:
+        """How many executor calls `count` images should be spread over: one per
+        idle worker, as few as max_batch_size allows, never more than the queue admits."""
+        parts = max(math.ceil(count / max(self.max_batch_size, 1)), min(count, self.executor.idle_workers))
+        return max(1, min(parts, count, self.executor.free_slots))
+
+    async def _run_chunk(
+        self, sources: List[ImageSource], model: str, output: OutputOptions, on_done: Optional[Callable[[], None]]
+    ) -> Tuple[List[Union[bytes, Exception]], Dict[str, float]]:
+        try:
+            return await self.executor.run_with_timings("process_batch", sources, output, model=model, on_done=on_done)
+        except Exception as e:
+            return [e] * len(sources), {}
+
+    async def process_many(
+        self,
+        sources: List[ImageSource],
+        model: str,
+        output: Optional[OutputOptions] = None,
+        reservation: Optional[Reservation] = None,
+    ) -> List[Union[bytes, Exception]]:
+        """Cut out several images at once, batched per worker so every idle worker
+        takes a share. Returns the encoded result or the exception per image;
+        reservation, if given, is held until every worker involved is done."""
+        output = output or OutputOptions()
+        chunks = split_evenly(sources, self.parts_for(len(sources)))
+        runs = await asyncio.gather(*(self._run_chunk(chunk, model, output, hold_all([reservation])) for chunk in chunks))
+        for _, timings in runs:
+            metrics.add_request_timings(timings)
+        return [outcome for outcomes, _ in runs for outcome in outcomes]
+
+    async def _run_batch(self, key: BatchKey, items: List[BatchItem]):
+        model, output = key
+        # Callers that gave up while the window was open have released their memory
+        items = [item for item in items if not item[1].done()]
+        if not items:
+            return
+        chunks = split_evenly(items, self.parts_for(len(items)))
+        if len(items) > 1:
+            logger.info(f"Coalesced {len(items)} requests into {len(chunks)} {model} inference batch(es)")
+        runs = await asyncio.gather(*(
+            self._run_chunk(
+                [source for source, _, _ in chunk], model, output, hold_all([reservation for _, _, reservation in chunk])
+            )
+            for chunk in chunks
+        ))
+        for chunk, (outcomes, timings) in zip(chunks, runs):
+            for (_, future, _), outcome in zip(chunk, outcomes):
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result((outcome, timings))
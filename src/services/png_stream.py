@@ -0,0 +1,64 @@
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+COLOR_TYPES = {"L": (0, 1), "RGB": (2, 3), "RGBA": (6, 4)}
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data)) + chunk_type + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+    )
+
+
+class StreamingPNGWriter:
+    """Encodes a PNG a band of rows at a time.
+
+    Pillow can only encode a complete image, so a full-resolution cutout would
+    have to exist in memory as one RGBA buffer plus its encoded copy. This
+    writer takes rows as they are produced and hands back IDAT chunks of
+    roughly chunk_size bytes that can be sent to the client straight away.
+    """
+
+    def __init__(self, width: int, height: int, mode: str = "RGBA", compress_level: int = 6, chunk_size: int = 256 * 1024):
+        if mode not in COLOR_TYPES:
+            raise ValueError(f"Unsupported PNG mode: {mode}")
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.color_type, self.channels = COLOR_TYPES[mode]
+        self.chunk_size = chunk_size
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = b""
+        self._rows_written = 0
+
+    def header(self) -> bytes:
+        ihdr = struct.pack(">IIBBBBB", self.width, self.height, 8, self.color_type, 0, 0, 0)
+        return PNG_SIGNATURE + _chunk(b"IHDR", ihdr)
+
+    def write(self, rows: np.ndarray) -> bytes:
+        """Add rows shaped (n, width, channels) as uint8; returns any IDAT chunks ready to send."""
+        rows = rows.reshape(rows.shape[0], self.width * self.channels)
+        # "Sub" filter: store each byte as the difference to the same channel
+        # of the previous pixel, which compresses far better than raw pixels
+        filtered = rows.copy()
+        filtered[:, self.channels:] -= rows[:, :-self.channels]
+        scanlines = np.empty((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)
+        scanlines[:, 0] = 1
+        scanlines[:, 1:] = filtered
+        self._rows_written += rows.shape[0]
+        self._pending += self._compressor.compress(scanlines.tobytes())
+        if len(self._pending) < self.chunk_size:
+            return b""
+        data, self._pending = self._pending, b""
+        return _chunk(b"IDAT", data)
+
+    def finish(self) -> bytes:
+        if self._rows_written != self.height:
+            raise ValueError(f"Wrote {self._rows_written} rows, expected {self.height}")
+        data = self._pending + self._compressor.flush()
+        self._pending = b""
+        return _chunk(b"IDAT", data) + _chunk(b"IEND", b"")
@@ -0,0 +1,161 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# RESULT_CACHE_MEMORY_MB when unset (per process)
+DEFAULT_MEMORY_MB = 256
+
+# make_key() output; anything else could name a path outside the cache directory
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class ResultCache:
+    """Content-addressed cache of encoded results.
+
+    Entries are keyed on a hash of the input bytes plus everything that changes
+    the output (model, processing parameters), so the same file processed the
+    same way is only run through the model once. A byte-bounded in-memory LRU
+    sits in front of an optional size-capped directory on disk; disk hits are
+    promoted back into memory. Processes sharing the directory (preforked
+    workers) see each other's entries, each capping the ones it wrote or read.
+    """
+
+    def __init__(self, max_memory_bytes: int, disk_dir: Optional[str] = None, max_disk_bytes: int = 0):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            max_memory_bytes=int(os.environ.get("RESULT_CACHE_MEMORY_MB", DEFAULT_MEMORY_MB)) * 1024 * 1024,
+            disk_dir=os.environ.get("RESULT_CACHE_DIR") or None,
+            max_disk_bytes=int(os.environ.get("RESULT_CACHE_DISK_MB", 2048)) * 1024 * 1024,
+        )
+
+    @staticmethod
+    def make_key(data: bytes, model_name: str, **params: Any) -> str:
+        digest = hashlib.sha256(data)
+        digest.update(model_name.encode())
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return KEY_PATTERN.fullmatch(key) is not None
+
+    def _disk_path(self, key: str) -> str:
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return os.path.join(self.disk_dir, f"{key}.bin")
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(".bin")], stat.st_size))
+        # Oldest first so the front of the OrderedDict is the next to evict
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        logger.info(f"Result cache found {len(self._disk)} entries on disk in {self.disk_dir}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+            if key in self._disk or (self.disk_dir and os.path.exists(self._disk_path(key))):
+                try:
+                    with open(self._disk_path(key), "rb") as f:
+                        value = f.read()
+                    os.utime(self._disk_path(key))
+                    if key not in self._disk:
+                        # Written by another process sharing the directory
+                        self._disk_bytes += len(value)
+                    self._disk[key] = len(value)
+                    self._disk.move_to_end(key)
+                    self._store_memory(key, value)
+                    self.hits += 1
+                    return value
+                except OSError as e:
+                    logger.warning(f"Dropping unreadable cache entry {key}: {str(e)}")
+                    self._disk_bytes -= self._disk.pop(key, 0)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: bytes):
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        with self._lock:
+            self._store_memory(key, value)
+            if self.disk_dir:
+                self._store_disk(key, value)
+
+    def _store_memory(self, key: str, value: bytes):
+        if len(value) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _store_disk(self, key: str, value: bytes):
+        if key in self._disk or len(value) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            # Write then rename so a crash never leaves a truncated entry behind
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(value)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {str(e)}")
+            return
+        self._disk[key] = len(value)
+        self._disk_bytes += len(value)
+        while self._disk_bytes > self.max_disk_bytes:
+            evicted, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._disk_path(evicted))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+            }
@@ -0,0 +1,396 @@
+from typing import Any, AsyncIterator, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from PIL import Image, ImageSequence
+import asyncio
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+from src.services.background_remover import PREVIEW_SIZE, OutputOptions, apply_mask, encode_image
+from src.services.inference_pool import InferenceExecutor, QueueFullError
+from src.services.job_manager import ChunkBuffer, result_filename
+from src.services.memory_budget import image_dimensions
+from src.services.metrics import stage
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff", ".gif")
+
+# Animated containers -> (Pillow format, media type)
+ANIMATION_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "apng": ("PNG", "image/apng"),
+}
+
+# Longest edge of the grayscale thumbnails frames are compared on
+THUMBNAIL_SIZE = 128
+
+
+class Frame(NamedTuple):
+    index: int
+    name: str
+    image: Image.Image
+    # Display time in milliseconds
+    duration: int
+
+
+class SequenceSource:
+    """The frames of one clip: a single animated image (GIF, WebP, APNG), a ZIP
+    of stills or several uploaded stills, in that order of precedence.
+
+    Only headers are read up front; frames are decoded one at a time while
+    iterating, so a clip is never fully decoded in memory.
+    """
+
+    def __init__(self, uploads: List[Tuple[str, bytes]], frame_duration: int = 40):
+        self.frame_duration = frame_duration
+        self.animation: Optional[Tuple[str, bytes]] = None
+        self.stills: List[Tuple[str, Any]] = []
+        if len(uploads) == 1 and zipfile.is_zipfile(io.BytesIO(uploads[0][1])):
+            self._archive = zipfile.ZipFile(io.BytesIO(uploads[0][1]))
+            names = sorted(
+                name for name in self._archive.namelist()
+                if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith("__MACOSX/")
+            )
+            self.stills = [(name, name) for name in names]
+        elif len(uploads) == 1:
+            try:
+                with Image.open(io.BytesIO(uploads[0][1])) as img:
+                    if getattr(img, "is_animated", False):
+                        self.animation = uploads[0]
+                        self.frame_count = img.n_frames
+                        self.size = img.size
+            except OSError:
+                # Video containers need a decoder this service does not ship
+                raise ValueError(f"{uploads[0][0]} is not an image, animated image or ZIP of images")
+            if not self.animation:
+                self.stills = list(uploads)
+        else:
+            self.stills = list(uploads)
+        if not self.animation:
+            if not self.stills:
+                raise ValueError("No image frames found")
+            self.frame_count = len(self.stills)
+            sizes = []
+            for filename, content in self.stills:
+                try:
+                    sizes.append(image_dimensions(self._read_still(content)))
+                except OSError:
+                    raise ValueError(f"{filename} is not a readable image")
+            self.size = (max(width for width, _ in sizes), max(height for _, height in sizes))
+
+    def _read_still(self, content: Any) -> bytes:
+        # ZIP entries are stored by name and only read when their frame is due
+        return self._archive.read(content) if isinstance(content, str) else content
+
+    def __iter__(self) -> Iterator[Frame]:
+        if self.animation:
+            with Image.open(io.BytesIO(self.animation[1])) as img:
+                for index, frame in enumerate(ImageSequence.Iterator(img)):
+                    with stage("decode"):
+                        image = frame.convert("RGB")
+                    yield Frame(index, f"frame_{index:05d}", image, frame.info.get("duration") or self.frame_duration)
+            return
+        for index, (filename, content) in enumerate(self.stills):
+            with stage("decode"), Image.open(io.BytesIO(self._read_still(content))) as img:
+                image = img.convert("RGB")
+            yield Frame(index, os.path.splitext(os.path.basename(filename))[0], image, self.frame_duration)
+
+
+def thumbnail(img: Image.Image) -> np.ndarray:
+    small = img.convert("L")
+    small.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR)
+    return np.asarray(small, dtype=np.float32)
+
+
+def move(img: np.ndarray, dy: float, dx: float) -> np.ndarray:
+    """img moved down by dy and right by dx, wrapping around; fractions of a
+    pixel are allowed (Fourier shift theorem: a move is a phase ramp)."""
+    ky = np.fft.fftfreq(img.shape[0])[:, None]
+    kx = np.fft.rfftfreq(img.shape[1])[None, :]
+    return np.fft.irfft2(np.fft.rfft2(img) * np.exp(-2j * np.pi * (ky * dy + kx * dx)), s=img.shape)
+
+
+def _inner(shape: Tuple[int, int], dy: float, dx: float) -> Tuple[slice, slice]:
+    # Leave out the borders a move wraps around into
+    margin_y, margin_x = int(np.ceil(abs(dy))) + 1, int(np.ceil(abs(dx))) + 1
+    return slice(margin_y, shape[0] - margin_y), slice(margin_x, shape[1] - margin_x)
+
+
+def estimate_shift(reference: np.ndarray, current: np.ndarray, iterations: int = 3) -> Tuple[float, float]:
+    """(dy, dx) such that current is roughly reference moved down by dy and right
+    by dx: whole pixels from phase correlation, then refined to a fraction of a
+    pixel with a few Lucas-Kanade steps."""
+    spectrum = np.fft.rfft2(current - current.mean()) * np.conj(np.fft.rfft2(reference - reference.mean()))
+    spectrum /= np.abs(spectrum) + 1e-9
+    correlation = np.fft.irfft2(spectrum, s=reference.shape)
+    height, width = correlation.shape
+    y, x = np.unravel_index(int(np.argmax(correlation)), correlation.shape)
+    dy = float(y - height if y > height // 2 else y)
+    dx = float(x - width if x > width // 2 else x)
+    for _ in range(iterations):
+        moved = move(reference, dy, dx)
+        inner = _inner(reference.shape, dy, dx)
+        grad_y, grad_x = (g[inner] for g in np.gradient(moved))
+        residual = (current - moved)[inner]
+        hessian = np.array([[np.sum(grad_y * grad_y), np.sum(grad_y * grad_x)], [np.sum(grad_y * grad_x), np.sum(grad_x * grad_x)]])
+        if abs(np.linalg.det(hessian)) < 1e-6:
+            break
+        step_y, step_x = np.linalg.solve(hessian, [np.sum(grad_y * residual), np.sum(grad_x * residual)])
+        # Moving further by (step_y, step_x) changes moved by about -step . gradient
+        dy, dx = dy - step_y, dx - step_x
+        if abs(step_y) < 0.01 and abs(step_x) < 0.01:
+            break
+    return dy, dx
+
+
+def shifted_difference(reference: np.ndarray, current: np.ndarray, dy: float, dx: float) -> float:
+    """Mean absolute difference between current and reference moved by (dy, dx),
+    away from the borders the move uncovers."""
+    if abs(dy) >= reference.shape[0] / 4 or abs(dx) >= reference.shape[1] / 4:
+        return float("inf")
+    inner = _inner(reference.shape, dy, dx)
+    return float(np.abs(current[inner] - move(reference, dy, dx)[inner]).mean())
+
+
+def shift_mask(mask: Image.Image, dx: int, dy: int) -> Image.Image:
+    if not dx and not dy:
+        return mask
+    return mask.transform(mask.size, Image.Transform.AFFINE, (1, 0, -dx, 0, 1, -dy), Image.Resampling.NEAREST, fillcolor=0)
+
+
+class FrameMatcher:
+    """Decides which frames can reuse the mask of the last frame the model ran on.
+
+    A frame reuses that keyframe's mask if their thumbnails differ by at most
+    threshold (mean absolute grey level), either as they are or after undoing
+    a global translation, in which case the mask is moved along with it. At
+    most max_reuse frames in a row skip the model, so slow drift is corrected.
+    """
+
+    def __init__(self, threshold: float = 2.0, max_reuse: int = 8):
+        self.threshold = threshold
+        self.max_reuse = max_reuse
+        self._reference: Optional[np.ndarray] = None
+        self._reference_size: Tuple[int, int] = (0, 0)
+        self._reused = 0
+
+    def match(self, img: Image.Image, thumb: np.ndarray) -> Optional[Tuple[int, int]]:
+        """Return the (dx, dy) to move the keyframe's mask by, or None if img is a new keyframe."""
+        reference = self._reference
+        if (
+            reference is not None
+            and self._reused < self.max_reuse
+            and img.size == self._reference_size
+            and thumb.shape == reference.shape
+        ):
+            shift: Optional[Tuple[float, float]] = (0.0, 0.0)
+            if float(np.abs(thumb - reference).mean()) > self.threshold:
+                shift = estimate_shift(reference, thumb)
+                if shifted_difference(reference, thumb, *shift) > self.threshold:
+                    shift = None
+            if shift is not None:
+                self._reused += 1
+                scale = img.width / reference.shape[1]
+                return round(shift[1] * scale), round(shift[0] * scale)
+        self._reference = thumb
+        self._reference_size = img.size
+        self._reused = 0
+        return None
+
+
+class SequenceProcessor:
+    """Cuts out frame sequences through a pipelined decode -> infer -> encode path.
+
+    Decoding, inference and encoding run concurrently, joined by queues that
+    hold at most buffer_frames frames each, so memory stays bounded however
+    long the clip is. Frames that FrameMatcher pairs with a keyframe reuse
+    its mask; the rest are sent to the model batch_size at a time, using one
+    executor slot per sequence.
+    """
+
+    def __init__(
+        self,
+        executor: InferenceExecutor,
+        batch_size: int = 8,
+        buffer_frames: int = 16,
+        reuse_threshold: float = 2.0,
+        max_reuse: int = 8,
+    ):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.buffer_frames = buffer_frames
+        self.reuse_threshold = reuse_threshold
+        self.max_reuse = max_reuse
+        self.frames_inferred = 0
+        self.frames_reused = 0
+
+    @classmethod
+    def from_env(cls, executor: InferenceExecutor) -> "SequenceProcessor":
+        return cls(
+            executor,
+            batch_size=int(os.environ.get("SEQUENCE_BATCH_SIZE", 8)),
+            buffer_frames=int(os.environ.get("SEQUENCE_BUFFER_FRAMES", 16)),
+            reuse_threshold=float(os.environ.get("SEQUENCE_REUSE_THRESHOLD", 2.0)),
+            max_reuse=int(os.environ.get("SEQUENCE_MAX_REUSE", 8)),
+        )
+
+    def frames_in_flight(self) -> int:
+        """Upper bound on full-resolution frames held at once, for the memory budget."""
+        return 2 * self.buffer_frames + self.batch_size + 1
+
+    async def _decode(self, source: SequenceSource, decoded: "asyncio.Queue[Any]"):
+        frames = iter(source)
+
+        def next_frame() -> Optional[Tuple[Frame, np.ndarray]]:
+            frame = next(frames, None)
+            return None if frame is None else (frame, thumbnail(frame.image))
+
+        try:
+            while True:
+                item = await asyncio.to_thread(next_frame)
+                await decoded.put(item)
+                if item is None:
+                    return
+        except Exception as e:
+            await decoded.put(e)
+
+    async def _predict(self, model: str, images: List[Image.Image]) -> List[Image.Image]:
+        smalls = []
+        for img in images:
+            small = img.copy()
+            small.thumbnail(PREVIEW_SIZE, Image.Resampling.BILINEAR)
+            smalls.append(small)
+        while True:
+            try:
+                return await self.executor.run("predict_masks", smalls, [img.size for img in images], model=model)
+            except QueueFullError as e:
+                # The response is already streaming, so wait for a slot instead of failing
+                await asyncio.sleep(e.retry_after)
+
+    async def _infer(self, model: str, decoded: "asyncio.Queue[Any]", masked: "asyncio.Queue[Any]"):
+        matcher = FrameMatcher(self.reuse_threshold, self.max_reuse)
+        keyframe_mask: Optional[Image.Image] = None
+        finished = False
+        try:
+            while not finished:
+                # Take whatever has been decoded, up to a batch, without waiting for more
+                chunk = []
+                while len(chunk) < self.batch_size and (not chunk or not decoded.empty()):
+                    item = await decoded.get()
+                    if isinstance(item, Exception):
+                        raise item
+                    if item is None:
+                        finished = True
+                        break
+                    chunk.append(item)
+                if not chunk:
+                    break
+                shifts = await asyncio.to_thread(lambda: [matcher.match(frame.image, thumb) for frame, thumb in chunk])
+                keyframes = [frame.image for (frame, _), shift in zip(chunk, shifts) if shift is None]
+                masks = iter(await self._predict(model, keyframes) if keyframes else [])
+                for (frame, _), shift in zip(chunk, shifts):
+                    if shift is None:
+                        keyframe_mask = next(masks)
+                        self.frames_inferred += 1
+                        await masked.put((frame, keyframe_mask, None))
+                    else:
+                        self.frames_reused += 1
+                        moved = await asyncio.to_thread(shift_mask, keyframe_mask, *shift)
+                        await masked.put((frame, moved, shift))
+            await masked.put(None)
+        except Exception as e:
+            await masked.put(e)
+
+    async def iter_masks(self, source: SequenceSource, model: str) -> AsyncIterator[Tuple[Frame, Image.Image, Optional[Tuple[int, int]]]]:
+        """Yield (frame, full-resolution mask, shift) in frame order; shift is
+        None for frames the model ran on, else how far the reused mask moved."""
+        decoded: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=self.buffer_frames)
+        masked: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=self.buffer_frames)
+        stages = [
+            asyncio.ensure_future(self._decode(source, decoded)),
+            asyncio.ensure_future(self._infer(model, decoded, masked)),
+        ]
+        try:
+            while True:
+                item = await masked.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in stages:
+                task.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+
+    async def iter_zip(self, source: SequenceSource, model: str, output: OutputOptions) -> AsyncIterator[bytes]:
+        """Stream every cut-out frame as a ZIP entry as soon as it is encoded,
+        followed by sequence.json describing which frames reused a mask."""
+        buffer = ChunkBuffer()
+        manifest: List[Dict[str, Any]] = []
+        names = set()
+        # Encoded images do not deflate, so store them as-is
+        with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+
+            def add_frame(name: str, img: Image.Image, mask: Image.Image):
+                # Compositing, encoding and the entry's CRC all run off the event loop
+                archive.writestr(name, encode_image(mask if output.mask_only else apply_mask(img, mask), output))
+
+            async for frame, mask, shift in self.iter_masks(source, model):
+                name = result_filename(frame.name, output.extension)
+                if name in names:
+                    name = f"{frame.index}_{name}"
+                names.add(name)
+                await asyncio.to_thread(add_frame, name, frame.image, mask)
+                manifest.append({"name": name, "inferred": shift is None, "shift": list(shift) if shift else None})
+                yield buffer.drain()
+            archive.writestr("sequence.json", json.dumps(self.summary(manifest), indent=2))
+        yield buffer.drain()
+
+    async def encode_animation(
+        self, source: SequenceSource, model: str, format: str, output: OutputOptions
+    ) -> Tuple[bytes, Dict[str, Any]]:
+        """Cut out every frame and encode them as one animated WebP or APNG.
+
+        Stills of different sizes are centred on a canvas of the largest size.
+        """
+        frames: List[Image.Image] = []
+        durations: List[int] = []
+        manifest: List[Dict[str, Any]] = []
+
+        def composite(img: Image.Image, mask: Image.Image) -> Image.Image:
+            result = mask if output.mask_only else apply_mask(img, mask)
+            if result.size == source.size:
+                return result
+            canvas = Image.new(result.mode, source.size)
+            canvas.paste(result, ((source.size[0] - result.width) // 2, (source.size[1] - result.height) // 2))
+            return canvas
+
+        async for frame, mask, shift in self.iter_masks(source, model):
+            frames.append(await asyncio.to_thread(composite, frame.image, mask))
+            durations.append(frame.duration)
+            manifest.append({"name": frame.name, "inferred": shift is None, "shift": list(shift) if shift else None})
+        pil_format = ANIMATION_FORMATS[format][0]
+        options: Dict[str, Any] = {}
+        if pil_format == "WEBP":
+            # Lossless unless a quality is given, like single WebP results
+            options = {"lossless": True} if output.quality is None else {"quality": output.quality, "alpha_quality": 100}
+        elif output.compress_level is not None:
+            options = {"compress_level": output.compress_level}
+
+        def encode() -> bytes:
+            with stage("encode"):
+                buffer = io.BytesIO()
+                frames[0].save(
+                    buffer, format=pil_format, save_all=True, append_images=frames[1:],
+                    duration=durations, loop=0, **options
+                )
+                return buffer.getvalue()
+
+        return await asyncio.to_thread(encode), self.summary(manifest)
+
+    @staticmethod
+    def summary(manifest: List[Dict[str, Any]]) -> Dict[str, Any]:
+        inferred = sum(1 for entry in manifest if entry["inferred"])
+        return {"frames": len(manifest), "inferred": inferred, "reused": len(manifest) - inferred, "items": manifest}
@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional
+from PIL import Image
+import logging
+import os
+import time
+
+from src.services.background_remover import BackgroundRemover
+
+logger = logging.getLogger(__name__)
+
+
+class SessionRegistry:
+    """Owns one BackgroundRemover per configured model and tracks its load state.
+
+    States go pending -> loading -> ready (or failed). Quality tiers are aliases
+    for loaded models: "preview" is the first configured model and "final" the
+    last, so MODELS=u2netp,isnet-general-use gives a fast preview and a
+    high-quality final pass.
+    """
+
+    def __init__(
+        self, model_names: List[str], intra_op_threads: Optional[int] = None, model_cache_dir: Optional[str] = None
+    ):
+        if not model_names:
+            raise ValueError("At least one model must be configured")
+        self.model_names = model_names
+        self.model_cache_dir = model_cache_dir
+        self.default_model = model_names[0]
+        self.tiers = {"preview": model_names[0], "final": model_names[-1]}
+        self.removers: Dict[str, BackgroundRemover] = {
+            name: BackgroundRemover(model_name=name, intra_op_threads=intra_op_threads, model_cache_dir=model_cache_dir)
+            for name in model_names
+        }
+        self.states: Dict[str, str] = {name: "pending" for name in model_names}
+        # Seconds each model took to load and run its warm-up image
+        self.load_seconds: Dict[str, float] = {}
+
+    @classmethod
+    def from_env(cls) -> "SessionRegistry":
+        names = [name.strip() for name in os.environ.get("MODELS", "u2netp").split(",") if name.strip()]
+        return cls(names, model_cache_dir=os.environ.get("ONNX_CACHE_DIR", "onnx_cache") or None)
+
+    def set_intra_op_threads(self, intra_op_threads: int):
+        for remover in self.removers.values():
+            remover.intra_op_threads = intra_op_threads
+
+    def resolve(self, model: Optional[str] = None, quality: Optional[str] = None) -> str:
+        """Map a requested model name or quality tier to a configured model."""
+        if model:
+            if model not in self.removers:
+                raise ValueError(f"Model '{model}' is not available, choose one of {', '.join(self.model_names)}")
+            return model
+        if quality:
+            if quality not in self.tiers:
+                raise ValueError(f"Unknown quality '{quality}', choose one of {', '.join(self.tiers)}")
+            return self.tiers[quality]
+        return self.default_model
+
+    def get(self, model: Optional[str] = None) -> BackgroundRemover:
+        return self.removers[model or self.default_model]
+
+    @property
+    def ready(self) -> bool:
+        return all(state == "ready" for state in self.states.values())
+
+    def warm_up(self) -> Dict[str, str]:
+        """Load every model and push a dummy image through it so the first real
+        request does not pay for session creation or ONNX graph initialisation."""
+        for name, remover in self.removers.items():
+            if self.states[name] == "ready":
+                continue
+            self.states[name] = "loading"
+            start_time = time.time()
+            try:
+                remover.predict_masks([Image.new("RGB", (320, 320))])
+                self.states[name] = "ready"
+                self.load_seconds[name] = time.time() - start_time
+                logger.info(f"Warmed up model {name} in {self.load_seconds[name]:.2f} seconds")
+            except Exception as e:
+                self.states[name] = "failed"
+                logger.error(f"Warm-up failed for model {name}: {str(e)}")
+        return dict(self.states)
@@ -0,0 +1,152 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+from rembg.sessions.u2net import U2netSession
+
+from src.services.background_remover import BackgroundRemover, OutputOptions
+from src.services.inference_pool import QueueFullError
+from src.services.micro_batcher import MicroBatcher, split_evenly
+
+
+class StubInnerSession:
+    """Stands in for an onnxruntime session: the "prediction" is a smooth
+    function of the normalized input, so pre- and post-processing both show."""
+
+    def __init__(self, batch_dim):
+        self.batch_dim = batch_dim
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input.1", shape=[self.batch_dim, 3, 320, 320])]
+
+    def run(self, outputs, feeds):
+        batch = feeds["input.1"]
+        self.batch_sizes.append(batch.shape[0])
+        pred = np.tanh(batch[:, :1] * 0.7 + batch[:, 1:2] * 0.2 - batch[:, 2:3] * 0.4)
+        return [pred.astype(np.float32)]
+
+
+def stub_remover(batch_dim):
+    session = U2netSession.__new__(U2netSession)
+    session.inner_session = StubInnerSession(batch_dim)
+    remover = BackgroundRemover("u2netp")
+    remover.session = session
+    return remover
+
+
+def sample_images():
+    y, x = np.mgrid[0:240, 0:360]
+    first = np.stack([x * 255 // 360, y * 255 // 240, (x * y) % 256], -1).astype(np.uint8)
+    second = np.stack([(x + y) % 256, 255 - x * 255 // 360, y * 255 // 240], -1).astype(np.uint8)
+    return [Image.fromarray(first), Image.fromarray(second).resize((200, 300))]
+
+
+@pytest.mark.parametrize("batch_dim, calls", [("batch", [2]), (1, [1, 1])])
+def test_predict_masks_matches_rembg_predict(batch_dim, calls):
+    remover = stub_remover(batch_dim)
+    images = sample_images()
+    expected = [np.asarray(remover.session.predict(img)[0], dtype=np.int16) for img in images]
+    remover.session.inner_session.batch_sizes.clear()
+
+    masks = remover.predict_masks(images)
+
+    assert remover.session.inner_session.batch_sizes == calls
+    for mask, img, reference in zip(masks, images, expected):
+        assert mask.mode == "L" and mask.size == img.size
+        assert np.abs(np.asarray(mask, dtype=np.int16) - reference).max() <= 1
+
+
+def test_predict_masks_resizes_to_requested_sizes():
+    remover = stub_remover("batch")
+
+    masks = remover.predict_masks(sample_images(), sizes=[(36, 24), (1000, 1500)])
+
+    assert [mask.size for mask in masks] == [(36, 24), (1000, 1500)]
+
+
+@pytest.mark.parametrize("count, parts, sizes", [(10, 3, [4, 3, 3]), (2, 4, [1, 1]), (5, 1, [5]), (0, 2, [])])
+def test_split_evenly(count, parts, sizes):
+    chunks = split_evenly(list(range(count)), parts)
+
+    assert [len(chunk) for chunk in chunks] == sizes
+    assert [item for chunk in chunks for item in chunk] == list(range(count))
+
+
+class StubExecutor:
+    def __init__(self, idle_workers=0, free_slots=8):
+        self.idle_workers = idle_workers
+        self.free_slots = free_slots
+        self.calls = []
+
+    def has_capacity(self, count=1):
+        return self.free_slots >= count
+
+    def retry_after(self):
+        return 2
+
+    async def run(self, method, source, output, model=None, on_done=None):
+        self.calls.append((method, [source]))
+        return f"cutout-{source}"
+
+    async def run_with_timings(self, method, sources, output, model=None, on_done=None):
+        self.calls.append((method, list(sources)))
+        return [f"cutout-{source}" for source in sources], {"inference": 0.01}
+
+
+@pytest.mark.parametrize("idle, free, batch_size, count, parts", [
+    (0, 8, 4, 10, 3),   # saturated: as few calls as max_batch_size allows
+    (3, 8, 8, 5, 3),    # one share per idle worker
+    (8, 8, 8, 2, 2),    # never more calls than images
+    (0, 2, 2, 10, 2),   # never more calls than the queue admits
+    (0, 0, 4, 3, 1),
+])
+def test_parts_for(idle, free, batch_size, count, parts):
+    batcher = MicroBatcher(StubExecutor(idle_workers=idle, free_slots=free), max_batch_size=batch_size)
+
+    assert batcher.parts_for(count) == parts
+
+
+def test_process_many_spreads_chunks_and_keeps_order():
+    executor = StubExecutor(idle_workers=3)
+    batcher = MicroBatcher(executor, max_batch_size=8)
+
+    outcomes = asyncio.run(batcher.process_many(list("abcdefg"), "u2netp", OutputOptions()))
+
+    assert outcomes == [f"cutout-{source}" for source in "abcdefg"]
+    assert [sources for _, sources in executor.calls] == [list("abc"), list("de"), list("fg")]
+
+
+def test_coalesced_requests_share_a_batch():
+    executor = StubExecutor(idle_workers=0)
+    batcher = MicroBatcher(executor, max_batch_size=4, max_delay_ms=50)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.process(source, "u2netp") for source in "abc"))
+
+    assert asyncio.run(scenario()) == ["cutout-a", "cutout-b", "cutout-c"]
+    assert executor.calls == [("process_batch", ["a", "b", "c"])]
+
+
+def test_idle_worker_skips_the_batch_window():
+    executor = StubExecutor(idle_workers=1)
+    batcher = MicroBatcher(executor, max_batch_size=4, max_delay_ms=10_000)
+
+    assert asyncio.run(batcher.process("a", "u2netp")) == "cutout-a"
+    assert executor.calls == [("process_bytes", ["a"])]
+
+
+def test_refused_request_leaves_no_open_window():
+    executor = StubExecutor(idle_workers=0, free_slots=0)
+    batcher = MicroBatcher(executor, max_batch_size=4)
+
+    with pytest.raises(QueueFullError):
+        asyncio.run(batcher.process("a", "u2netp"))
+    assert batcher._items == {}
+
+    # Once capacity is back an idle worker is used straight away, not the window
+    executor.idle_workers, executor.free_slots = 1, 8
+    assert asyncio.run(batcher.process("b", "u2netp")) == "cutout-b"
+    assert executor.calls == [("process_bytes", ["b"])]
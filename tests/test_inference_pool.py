@@ -0,0 +1,116 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from src.services.inference_pool import InferenceExecutor, QueueFullError
+from src.services.memory_budget import MemoryBudget, Reservation
+
+
+class BlockingRemover:
+    def __init__(self):
+        self.started = threading.Event()
+        self.finish = threading.Event()
+
+    def wait(self) -> str:
+        self.started.set()
+        self.finish.wait(5)
+        return "done"
+
+
+class StubRegistry:
+    model_names = ["stub"]
+    default_model = "stub"
+    model_cache_dir = None
+
+    def __init__(self):
+        self.remover = BlockingRemover()
+
+    def get(self, model=None):
+        return self.remover
+
+    def set_intra_op_threads(self, intra_op_threads: int):
+        pass
+
+
+def make_executor() -> InferenceExecutor:
+    return InferenceExecutor(StubRegistry(), workers=1, max_pending=1, intra_op_threads=1)
+
+
+def test_rejects_calls_over_the_queue_size():
+    async def scenario():
+        executor = make_executor()
+        running = asyncio.ensure_future(executor.run("wait"))
+        await asyncio.to_thread(executor.registry.remover.started.wait, 5)
+        with pytest.raises(QueueFullError) as raised:
+            await executor.run("wait")
+        assert raised.value.retry_after >= 1
+        executor.registry.remover.finish.set()
+        assert await running == "done"
+        assert executor.pending == 0
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_call_keeps_its_slot_until_the_worker_finishes():
+    async def scenario():
+        executor = make_executor()
+        budget = MemoryBudget(100)
+        assert budget.try_acquire(60)
+        reservation = Reservation(budget, 60)
+        remover = executor.registry.remover
+
+        task = asyncio.ensure_future(executor.run("wait", on_done=reservation.hold()))
+        await asyncio.to_thread(remover.started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        reservation.release()
+
+        # The worker is still running the cancelled call
+        assert executor.pending == 1
+        assert budget.in_use == 60
+        with pytest.raises(QueueFullError):
+            await executor.run("wait")
+
+        remover.finish.set()
+        for _ in range(100):
+            if executor.pending == 0 and budget.in_use == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert executor.pending == 0
+        assert budget.in_use == 0
+        executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_rejected_call_runs_on_done():
+    async def scenario():
+        executor = make_executor()
+        executor.max_pending = 0
+        released = []
+        with pytest.raises(QueueFullError):
+            await executor.run("wait", on_done=lambda: released.append(True))
+        assert released == [True]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_answers_429_with_retry_after(tmp_path, monkeypatch):
+    from src import server
+
+    image_path = tmp_path / "image.png"
+    Image.new("RGB", (64, 48), "red").save(image_path)
+    monkeypatch.setattr(server.executor, "_pending", server.executor.max_pending)
+    monkeypatch.setattr(server.executor, "_avg_task_seconds", 3.0)
+
+    # No lifespan: the request must be turned away before any model is needed
+    response = TestClient(server.app).post("/remove_bg", data={"image_path": str(image_path)})
+
+    assert response.status_code == 429
+    expected = -(-server.executor.max_pending * 3 // server.executor.workers)
+    assert response.headers["Retry-After"] == str(expected)
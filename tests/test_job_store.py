@@ -0,0 +1,68 @@
+import time
+
+from src.services.job_store import SQLiteJobStore
+
+
+def create(store: SQLiteJobStore, job_id: str, owner: int, items: int = 3):
+    store.create_job(job_id, "u2netp", [{"filename": f"{index}.png"} for index in range(items)], owner=owner)
+
+
+def statuses(store: SQLiteJobStore, job_id: str):
+    return [item["status"] for item in store.get_items(job_id)]
+
+
+def test_restart_requeues_interrupted_items(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    store = SQLiteJobStore(path)
+    create(store, "job", owner=100)
+    store.set_job_status("job", "running")
+    store.update_item("job", 0, "done", result_path="0.png")
+    store.update_item("job", 1, "processing")
+
+    restarted = SQLiteJobStore(path)
+
+    assert restarted.unfinished_jobs(owner=200) == ["job"]
+    assert statuses(restarted, "job") == ["done", "queued", "queued"]
+    job = restarted.get_job("job")
+    assert job["owner"] == 200
+    assert (job["done"], job["queued"], job["total"]) == (1, 2, 3)
+    assert restarted.get_item("job", 0)["result_path"] == "0.png"
+
+
+def test_finished_jobs_are_not_resumed(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    create(store, "done", owner=100)
+    store.set_job_status("done", "done")
+    create(store, "queued", owner=100)
+
+    assert store.unfinished_jobs(owner=200) == ["queued"]
+
+
+def test_takeover_only_claims_the_dead_workers_jobs(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    create(store, "first", owner=100)
+    create(store, "second", owner=101)
+    store.update_item("second", 0, "processing")
+
+    assert store.unfinished_jobs(owner=300, previous_owner=100) == ["first"]
+    assert store.get_job("first")["owner"] == 300
+    assert store.get_job("second")["owner"] == 101
+    assert statuses(store, "second")[0] == "processing"
+
+
+def test_expired_jobs_and_delete(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    create(store, "old", owner=100)
+    store.set_job_status("old", "done")
+    create(store, "running", owner=100)
+    time.sleep(0.01)
+    cutoff = time.time()
+    time.sleep(0.01)
+    create(store, "new", owner=100)
+    store.set_job_status("new", "done")
+
+    assert store.expired_jobs(cutoff) == ["old"]
+    assert store.delete_job("old")
+    assert store.get_job("old") is None
+    assert store.get_items("old") == []
+    assert not store.delete_job("old")
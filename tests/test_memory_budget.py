@@ -0,0 +1,53 @@
+import io
+
+import pytest
+from PIL import Image
+
+from src.services.memory_budget import ImageTooLargeError, MemoryBudget, Reservation, image_info
+
+
+def test_each_path_has_its_own_cost():
+    budget = MemoryBudget(1 << 40)
+
+    full = budget.estimate(6000, 4000, "full")
+    assert full == 6000 * 4000 * MemoryBudget.COST_PER_PIXEL["full"]
+    assert budget.estimate(6000, 4000, "tiled") < full < budget.estimate(6000, 4000, "process")
+    assert budget.estimate(6000, 4000, "decode", "PNG") == 6000 * 4000 * MemoryBudget.COST_PER_PIXEL["decode"]
+
+
+@pytest.mark.parametrize("size, scale", [((6000, 4000), 8), ((2000, 1500), 2), ((800, 600), 1), ((400, 300), 1)])
+def test_jpeg_decodes_are_priced_at_the_draft_size(size, scale):
+    budget = MemoryBudget(1 << 40)
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format="JPEG")
+    with Image.open(buffer) as img:
+        img.draft("RGB", MemoryBudget.DRAFT_SIZE)
+        drafted = img.size
+
+    width, height, image_format = image_info(buffer.getvalue())
+
+    assert image_format == "JPEG"
+    assert drafted == (-(-size[0] // scale), -(-size[1] // scale))
+    assert budget.estimate(width, height, "decode", image_format) == drafted[0] * drafted[1] * MemoryBudget.COST_PER_PIXEL["decode"]
+
+
+def test_check_rejects_what_the_path_could_never_fit():
+    budget = MemoryBudget(100 * 1024 * 1024)
+
+    assert budget.check(2200, 2200, "tiled") == 2200 * 2200 * MemoryBudget.COST_PER_PIXEL["tiled"]
+    with pytest.raises(ImageTooLargeError):
+        budget.check(2200, 2200, "full")
+
+
+def test_reservation_is_returned_after_the_last_holder():
+    budget = MemoryBudget(100)
+    assert budget.try_acquire(60)
+    reservation = Reservation(budget, 60)
+    worker_done = reservation.hold()
+
+    reservation.release()
+    assert budget.in_use == 60
+    assert not budget.try_acquire(50)
+
+    worker_done()
+    assert budget.in_use == 0
@@ -0,0 +1,94 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.services import background_remover
+from src.services.background_remover import OutputOptions, encode_image, sniff_output_format
+
+
+def make_cutout(width: int = 64, height: int = 48) -> Image.Image:
+    y, x = np.mgrid[0:height, 0:width]
+    rgba = np.stack([x * 255 // width, y * 255 // height, (x + y) % 256, 1 + (x * 4) % 255], axis=-1).astype(np.uint8)
+    return Image.fromarray(rgba, "RGBA")
+
+
+def decode(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+
+@pytest.mark.parametrize(
+    "options, message",
+    [
+        (OutputOptions("gif"), "Unknown output format"),
+        (OutputOptions(quality=0), "quality"),
+        (OutputOptions(quality=101), "quality"),
+        (OutputOptions(compress_level=10), "compression level"),
+        (OutputOptions("webp", mask_only=True), "mask_only"),
+    ],
+)
+def test_validate_rejects(options, message):
+    with pytest.raises(ValueError, match=message):
+        options.validate()
+
+
+def test_validate_rejects_avif_without_encoder(monkeypatch):
+    monkeypatch.setattr(background_remover.features, "check", lambda feature: feature != "avif")
+    with pytest.raises(ValueError, match="AVIF"):
+        OutputOptions("avif").validate()
+    assert OutputOptions("webp").validate().format == "webp"
+
+
+def test_validate_accepts_defaults():
+    assert OutputOptions().validate() == OutputOptions("png", None, None, False)
+    assert OutputOptions("png", quality=100, compress_level=0, mask_only=True).validate().mask_only
+
+
+@pytest.mark.parametrize("fmt", ["png", "webp", "avif"])
+def test_encoded_format_is_sniffed(fmt):
+    if fmt == "avif" and not background_remover.features.check("avif"):
+        pytest.skip("Pillow was built without AVIF")
+    data = encode_image(make_cutout(), OutputOptions(fmt))
+    assert sniff_output_format(data) == fmt
+    assert decode(data).size == (64, 48)
+
+
+def test_sniff_unknown_bytes():
+    assert sniff_output_format(b"GIF89a" + bytes(16)) is None
+
+
+def test_webp_is_lossless_unless_quality_given():
+    cutout = make_cutout()
+    lossless = decode(encode_image(cutout, OutputOptions("webp")))
+    assert np.array_equal(np.asarray(lossless), np.asarray(cutout))
+
+    lossy = decode(encode_image(cutout, OutputOptions("webp", quality=50)))
+    # Colours may drift but the alpha channel is kept exact
+    assert np.array_equal(np.asarray(lossy)[..., 3], np.asarray(cutout)[..., 3])
+
+
+@pytest.mark.parametrize("fmt", ["png", "avif"])
+def test_mask_only_stays_single_channel(fmt):
+    if fmt == "avif" and not background_remover.features.check("avif"):
+        pytest.skip("Pillow was built without AVIF")
+    mask = make_cutout().getchannel("A")
+    assert decode(encode_image(mask, OutputOptions(fmt, mask_only=True))).mode == "L"
+
+
+def test_png_compress_level_override(monkeypatch):
+    levels = []
+    real_save = Image.Image.save
+
+    def save(img, fp, format=None, **params):
+        levels.append(params.get("compress_level"))
+        return real_save(img, fp, format=format, **params)
+
+    monkeypatch.setattr(Image.Image, "save", save)
+    cutout = make_cutout()
+    encode_image(cutout, OutputOptions("png"))
+    encode_image(cutout, OutputOptions("png"), full=True)
+    encode_image(cutout, OutputOptions("png", compress_level=9), full=True)
+    assert levels == [1, 6, 9]
@@ -0,0 +1,78 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.services.background_remover import OutputOptions, apply_mask, iter_cutout_png
+from src.services.png_stream import StreamingPNGWriter
+
+
+def make_image(width: int = 320, height: int = 200) -> Image.Image:
+    y, x = np.mgrid[0:height, 0:width]
+    rgb = np.stack([x * 255 // width, y * 255 // height, (x + y) % 256], axis=-1).astype(np.uint8)
+    return Image.fromarray(rgb)
+
+
+def make_mask(width: int = 64, height: int = 40) -> Image.Image:
+    y, x = np.mgrid[0:height, 0:width]
+    inside = (x - width / 2) ** 2 / (width / 3) ** 2 + (y - height / 2) ** 2 / (height / 3) ** 2
+    return Image.fromarray((np.clip(1.5 - inside, 0, 1) * 255).astype(np.uint8))
+
+
+def encode(img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def decode(chunks) -> Image.Image:
+    img = Image.open(io.BytesIO(b"".join(chunks)))
+    img.load()
+    return img
+
+
+@pytest.mark.parametrize("strip_height", [1, 7, 64, 1000])
+def test_streamed_cutout_matches_apply_mask(strip_height):
+    img, mask = make_image(), make_mask()
+    expected = np.asarray(apply_mask(img, mask.resize(img.size, Image.Resampling.BICUBIC)), dtype=np.int16)
+
+    streamed = decode(iter_cutout_png(encode(img), mask, strip_height=strip_height))
+
+    assert streamed.mode == "RGBA"
+    assert streamed.size == img.size
+    # Bands are resampled separately, so edge rows may differ by rounding
+    assert np.abs(np.asarray(streamed, dtype=np.int16) - expected).max() <= 2
+
+
+def test_streamed_mask_only_is_the_upsampled_mask():
+    img, mask = make_image(), make_mask()
+
+    streamed = decode(iter_cutout_png(encode(img), mask, strip_height=32, output=OutputOptions(mask_only=True)))
+
+    assert streamed.mode == "L"
+    expected = np.asarray(mask.resize(img.size, Image.Resampling.BICUBIC), dtype=np.int16)
+    assert np.abs(np.asarray(streamed, dtype=np.int16) - expected).max() <= 2
+
+
+def test_streaming_rejects_other_formats():
+    with pytest.raises(ValueError):
+        list(iter_cutout_png(encode(make_image()), make_mask(), output=OutputOptions("webp")))
+
+
+@pytest.mark.parametrize("mode", ["L", "RGB", "RGBA"])
+def test_writer_round_trip(mode):
+    channels = {"L": 1, "RGB": 3, "RGBA": 4}[mode]
+    rows = np.random.default_rng(0).integers(0, 256, (50, 30, channels), dtype=np.uint8)
+    writer = StreamingPNGWriter(30, 50, mode=mode, chunk_size=64)
+
+    chunks = [writer.header()] + [writer.write(rows[top:top + 8]) for top in range(0, 50, 8)] + [writer.finish()]
+
+    assert np.array_equal(np.asarray(decode(chunks)).reshape(rows.shape), rows)
+
+
+def test_writer_checks_row_count():
+    writer = StreamingPNGWriter(4, 4, mode="L")
+    writer.write(np.zeros((3, 4, 1), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.finish()
@@ -0,0 +1,85 @@
+import base64
+import io
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from src import server
+from src.services.background_remover import BackgroundRemover
+
+
+@pytest.fixture
+def client(monkeypatch):
+    decodes = []
+    decode = BackgroundRemover.decode
+
+    def counting_decode(self, *args, **kwargs):
+        decodes.append(args)
+        return decode(self, *args, **kwargs)
+
+    def half_mask(self, images, sizes=None):
+        # Left half opaque, right half transparent, in place of the model
+        masks = []
+        for size in sizes or [img.size for img in images]:
+            alpha = np.zeros((size[1], size[0]), dtype=np.uint8)
+            alpha[:, :size[0] // 2] = 255
+            masks.append(Image.fromarray(alpha))
+        return masks
+
+    monkeypatch.setattr(BackgroundRemover, "decode", counting_decode)
+    monkeypatch.setattr(BackgroundRemover, "predict_masks", half_mask)
+    # No lifespan: models are never loaded
+    test_client = TestClient(server.app)
+    test_client.decodes = decodes
+    return test_client
+
+
+def test_process_then_save_result(client, tmp_path):
+    image_path = tmp_path / "photo.jpg"
+    Image.new("RGB", (1200, 800), (200, 30, 40)).save(image_path)
+    save_path = tmp_path / "out" / "photo.png"
+
+    response = client.post("/process", data={"image_path": str(image_path), "include_original": "true", "model": "u2netp"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["cache"] == "MISS"
+    assert len(client.decodes) == 1
+    assert body["metadata"]["width"] == 1200 and body["metadata"]["format"] == "JPEG"
+    cutout = base64.b64decode(body["cutout"])
+    with Image.open(io.BytesIO(cutout)) as img:
+        assert (img.format, img.mode, img.size) == ("PNG", "RGBA", (500, 333))
+        assert img.getpixel((10, 10))[3] == 255 and img.getpixel((490, 10))[3] == 0
+    assert body["original_media_type"] == "image/jpeg"
+    with Image.open(io.BytesIO(base64.b64decode(body["original"]))) as original:
+        assert original.size == (500, 333)
+
+    saved = client.post("/save_result", data={"result_id": body["result_id"], "save_path": str(save_path)})
+
+    assert saved.status_code == 200
+    assert save_path.read_bytes() == cutout
+
+
+def test_cached_process_still_returns_the_original(client, tmp_path):
+    image_path = tmp_path / "logo.png"
+    Image.new("RGBA", (300, 200), (0, 0, 255, 128)).save(image_path)
+    data = {"image_path": str(image_path), "include_original": "true", "model": "u2netp"}
+
+    first = client.post("/process", data=data).json()
+    second = client.post("/process", data=data).json()
+
+    assert (first["cache"], second["cache"]) == ("MISS", "HIT")
+    assert second["result_id"] == first["result_id"]
+    assert second["original_media_type"] == first["original_media_type"] == "image/png"
+    with Image.open(io.BytesIO(base64.b64decode(second["original"]))) as original:
+        assert original.mode == "RGBA" and original.getpixel((0, 0))[3] == 128
+
+
+def test_save_result_rejects_unknown_and_malformed_ids(client, tmp_path):
+    target = str(tmp_path / "out.png")
+
+    assert client.post("/save_result", data={"result_id": "0" * 64, "save_path": target}).status_code == 404
+    assert client.post("/save_result", data={"result_id": "../secret", "save_path": target}).status_code == 400
+    assert not (tmp_path / "out.png").exists()
@@ -0,0 +1,59 @@
+import numpy as np
+from PIL import Image
+
+from src.services.background_remover import _box_filter, refine_mask
+
+
+def edge_guide(width: int = 400, height: int = 300, edge: int = 203) -> Image.Image:
+    rgb = np.full((height, width, 3), 30, dtype=np.uint8)
+    rgb[:, edge:] = 220
+    return Image.fromarray(rgb)
+
+
+def coarse_mask(width: int = 400, height: int = 300, edge: int = 203, size=(40, 30)) -> Image.Image:
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    alpha[:, edge:] = 255
+    return Image.fromarray(alpha).resize(size, Image.Resampling.BILINEAR)
+
+
+def test_box_filter_matches_windowed_mean():
+    values = np.random.default_rng(0).random((9, 11)).astype(np.float32)
+
+    smoothed = _box_filter(values, 2)
+
+    for y, x in [(0, 0), (4, 5), (8, 10), (2, 9)]:
+        window = values[max(y - 2, 0):y + 3, max(x - 2, 0):x + 3]
+        assert np.isclose(smoothed[y, x], window.mean(), atol=1e-5)
+
+
+def test_refined_mask_has_the_guide_size():
+    guide = edge_guide()
+
+    refined = refine_mask(coarse_mask(), guide)
+
+    assert refined.mode == "L"
+    assert refined.size == guide.size
+
+
+def test_refined_edge_follows_the_guide():
+    guide, mask = edge_guide(edge=203), coarse_mask(edge=203)
+    upsampled = np.asarray(mask.resize(guide.size, Image.Resampling.BILINEAR), dtype=np.float32)
+
+    refined = np.asarray(refine_mask(mask, guide), dtype=np.float32)
+
+    # The steepest step in alpha sits on the guide's edge, and is steeper
+    # than anything plain upsampling produces
+    steps = np.diff(refined, axis=1)
+    assert set(np.argmax(steps, axis=1)) == {202}
+    assert steps[:, 202].min() > 2 * np.diff(upsampled, axis=1).max()
+    assert np.abs(refined[:, :150]).max() <= 1
+    assert np.abs(refined[:, 260:] - 255).max() <= 1
+
+
+def test_uniform_mask_is_unchanged():
+    guide = edge_guide()
+
+    for value in (0, 255):
+        mask = Image.new("L", (40, 30), value)
+        refined = np.asarray(refine_mask(mask, guide), dtype=np.int16)
+        assert np.abs(refined - value).max() <= 1
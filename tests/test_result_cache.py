@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from src.services.result_cache import ResultCache
+
+
+def key(name: str) -> str:
+    return ResultCache.make_key(name.encode(), "u2netp")
+
+
+def test_make_key_depends_on_every_parameter():
+    base = ResultCache.make_key(b"image", "u2netp", size="full", refine=False)
+
+    assert ResultCache.is_valid_key(base)
+    assert base == ResultCache.make_key(b"image", "u2netp", refine=False, size="full")
+    assert base != ResultCache.make_key(b"image", "isnet-general-use", size="full", refine=False)
+    assert base != ResultCache.make_key(b"image", "u2netp", size="full", refine=True)
+    assert base != ResultCache.make_key(b"other", "u2netp", size="full", refine=False)
+
+
+def test_memory_evicts_least_recently_used():
+    cache = ResultCache(max_memory_bytes=30)
+    cache.put(key("a"), b"a" * 10)
+    cache.put(key("b"), b"b" * 10)
+    cache.put(key("c"), b"c" * 10)
+
+    assert cache.get(key("a")) == b"a" * 10
+    cache.put(key("d"), b"d" * 10)
+
+    assert cache.get(key("b")) is None
+    assert [cache.get(key(name)) for name in "acd"] == [name.encode() * 10 for name in "acd"]
+    assert cache.stats()["memory_bytes"] == 30
+
+
+def test_memory_skips_values_larger_than_the_budget():
+    cache = ResultCache(max_memory_bytes=30)
+    cache.put(key("small"), b"s" * 10)
+    cache.put(key("large"), b"l" * 31)
+
+    assert cache.get(key("large")) is None
+    assert cache.get(key("small")) == b"s" * 10
+
+
+def test_disk_evicts_oldest_entries(tmp_path):
+    cache = ResultCache(max_memory_bytes=0, disk_dir=str(tmp_path), max_disk_bytes=25)
+    for name in "abc":
+        cache.put(key(name), name.encode() * 10)
+
+    assert sorted(os.listdir(tmp_path)) == sorted(f"{key(name)}.bin" for name in "bc")
+    assert cache.get(key("a")) is None
+    assert cache.get(key("c")) == b"c" * 10
+    assert cache.stats()["disk_bytes"] == 20
+
+
+def test_disk_entries_survive_a_restart(tmp_path):
+    ResultCache(max_memory_bytes=100, disk_dir=str(tmp_path), max_disk_bytes=100).put(key("a"), b"cutout")
+
+    restarted = ResultCache(max_memory_bytes=100, disk_dir=str(tmp_path), max_disk_bytes=100)
+
+    assert restarted.stats()["disk_entries"] == 1
+    assert restarted.get(key("a")) == b"cutout"
+    assert restarted.stats()["memory_entries"] == 1
+
+
+@pytest.mark.parametrize("bad_key", ["../secret", "a" * 63, "A" * 64, key("a") + "/", ""])
+def test_rejects_keys_that_are_not_hashes(tmp_path, bad_key):
+    cache = ResultCache(max_memory_bytes=100, disk_dir=str(tmp_path), max_disk_bytes=100)
+
+    with pytest.raises(ValueError):
+        cache.get(bad_key)
+    with pytest.raises(ValueError):
+        cache.put(bad_key, b"value")
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from src.services.sequence import FrameMatcher, estimate_shift, move, shift_mask, shifted_difference, thumbnail
+
+
+def texture(size: int = 128, seed: int = 0) -> np.ndarray:
+    noise = np.random.default_rng(seed).integers(0, 256, (size, size), dtype=np.uint8)
+    return np.asarray(Image.fromarray(noise).filter(ImageFilter.GaussianBlur(2)), dtype=np.float32)
+
+
+def frame(size: int = 512, dx: int = 0, dy: int = 0, seed: int = 0) -> Image.Image:
+    noise = np.random.default_rng(seed).integers(0, 256, (size // 8, size // 8), dtype=np.uint8)
+    img = Image.fromarray(noise).resize((size, size), Image.Resampling.BICUBIC)
+    return Image.fromarray(np.roll(np.asarray(img), (dy, dx), axis=(0, 1))).convert("RGB")
+
+
+@pytest.mark.parametrize("dy, dx", [(0, 0), (5, -3), (-12, 7), (3.4, -5.7), (0.25, 0.5)])
+def test_estimate_shift_round_trip(dy, dx):
+    reference = texture()
+
+    estimated = estimate_shift(reference, move(reference, dy, dx))
+
+    assert estimated == pytest.approx((dy, dx), abs=0.05)
+    assert shifted_difference(reference, move(reference, dy, dx), *estimated) < 0.5
+
+
+def test_shifted_difference_rejects_large_moves():
+    reference = texture()
+
+    assert shifted_difference(reference, reference, 40, 0) == float("inf")
+
+
+def test_shift_mask_moves_and_clears():
+    mask = Image.fromarray(np.arange(16, dtype=np.uint8).reshape(4, 4) + 1)
+
+    moved = np.asarray(shift_mask(mask, 1, 2))
+
+    assert (moved[:2] == 0).all() and (moved[:, :1] == 0).all()
+    assert np.array_equal(moved[2:, 1:], np.asarray(mask)[:2, :3])
+    assert shift_mask(mask, 0, 0) is mask
+
+
+def match(matcher: FrameMatcher, img: Image.Image):
+    return matcher.match(img, thumbnail(img))
+
+
+def test_matcher_reuses_identical_and_moved_frames():
+    matcher = FrameMatcher()
+
+    assert match(matcher, frame()) is None
+    assert match(matcher, frame()) == (0, 0)
+    assert match(matcher, frame(dx=8, dy=-12)) == (8, -12)
+
+
+def test_matcher_starts_a_new_keyframe_on_a_scene_change():
+    matcher = FrameMatcher()
+    match(matcher, frame(seed=0))
+
+    assert match(matcher, frame(seed=1)) is None
+    # The new frame is now the keyframe
+    assert match(matcher, frame(seed=1)) == (0, 0)
+
+
+def test_matcher_limits_reuse_and_needs_same_size():
+    matcher = FrameMatcher(max_reuse=2)
+    match(matcher, frame())
+
+    assert [match(matcher, frame()) for _ in range(3)] == [(0, 0), (0, 0), None]
+    assert match(matcher, frame(size=256)) is None